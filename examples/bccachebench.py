@@ -0,0 +1,88 @@
+"""\
+    This benchmark compares the size of the bytecode cache items and the time
+    it takes to load templates from a warm bytecode cache with and without
+    compression.  The memcached cache talks to an in-process dictionary unless
+    a server address is passed as first argument and python-memcached is
+    installed.\
+"""
+import sys
+import shutil
+import tempfile
+from time import time
+from jinja2 import Environment, DictLoader, FileSystemBytecodeCache, \
+     MemcachedBytecodeCache, clear_caches
+
+snippet = """\
+  {% for item in items %}
+    <div class="item{{ loop.cycle(' odd', '') }}">
+      <h2>{{ item.title|e }}</h2>
+      {% if item.tags %}<ul>{% for tag in item.tags %}
+        <li><a href="/tags/{{ tag|lower }}">{{ tag|e }}</a></li>
+      {% endfor %}</ul>{% endif %}
+      {{ item.body|truncate(200) }}
+    </div>
+  {% endfor %}
+"""
+
+templates = dict(('page%d.html' % x, '{% extends "layout.html" %}'
+                  '{% block body %}' + snippet * 5 +
+                  '{%% endblock %%}{# %d #}' % x) for x in range(100))
+templates['layout.html'] = '<body>{% block body %}{% endblock %}</body>'
+names = sorted(templates)
+
+
+class DictClient(object):
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.data[key] = value
+
+    def get_multi(self, keys):
+        return dict((x, self.data[x]) for x in keys if x in self.data)
+
+    def set_multi(self, mapping, timeout=None):
+        self.data.update(mapping)
+
+
+def make_client():
+    if len(sys.argv) > 1:
+        import memcache
+        return memcache.Client([sys.argv[1]])
+    return DictClient()
+
+
+def bench(bcc):
+    clear_caches()
+    env = Environment(loader=DictLoader(templates), bytecode_cache=bcc)
+    env.get_templates(names)
+    buckets = bcc.get_buckets(env, [(x, None, templates[x]) for x in names])
+    size = sum(len(x.bytecode_to_string()) for x in buckets)
+    times = []
+    for x in range(10):
+        clear_caches()
+        env = Environment(loader=DictLoader(templates), bytecode_cache=bcc)
+        start = time()
+        env.get_templates(names)
+        times.append(time() - start)
+    sys.stdout.write('    %-30s%10d bytes %10.2f ms\n' %
+                     (bcc.__class__.__name__ + ' (%s)' % bcc.compression,
+                      size, min(times) * 1000))
+
+
+if __name__ == '__main__':
+    sys.stdout.write('Bytecode Cache Benchmark (%d templates)\n' %
+                     len(templates))
+    for compression in None, 'zlib':
+        directory = tempfile.mkdtemp()
+        try:
+            bench(FileSystemBytecodeCache(directory, compression=compression))
+        finally:
+            shutil.rmtree(directory)
+    for compression in None, 'zlib':
+        bench(MemcachedBytecodeCache(make_client(), 'bccachebench/%s/' %
+                                     compression, compression=compression))
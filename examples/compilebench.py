@@ -0,0 +1,54 @@
+"""\
+    This benchmark measures how long it takes Jinja 2 to parse and compile
+    big templates and deeply nested loops.  Pass the number of repetitions
+    of the template snippet as first argument.\
+"""
+import sys
+from timeit import Timer
+from jinja2 import Environment
+
+snippet = """\
+<div class="section">
+  <h2>{{ title|e }}</h2>
+  {% for item in items if item.visible %}
+    <p class="{{ loop.cycle('odd', 'even') }}">{{ item.name|title }}</p>
+  {% else %}
+    <p>No items</p>
+  {% endfor %}
+  {% if user %}{{ user.name }}{% else %}anonymous{% endif %}
+  {% set count = items|length %}{{ count }}
+</div>
+"""
+
+count = len(sys.argv) > 1 and int(sys.argv[1]) or 200
+source = '{% macro render(title, items) %}' + snippet + \
+         '{% endmacro %}\n' + snippet * count
+
+nested_source = ''.join('{%% for x%d in seq %%}{{ loop.index }}{{ x%d|e }}'
+                        % (x, x) for x in range(count // 4)) + \
+                '{% endfor %}' * (count // 4)
+
+env = Environment()
+
+
+def test_compile():
+    env.compile(source, raw=True)
+
+
+def test_parse():
+    env.parse(source)
+
+
+def test_compile_nested():
+    env.compile(nested_source, raw=True)
+
+
+if __name__ == '__main__':
+    sys.stdout.write('Compile Benchmark (%d snippets)\n' % count)
+    for test in 'parse', 'compile', 'compile_nested':
+        t = Timer(setup='from __main__ import test_%s as bench' % test,
+                  stmt='bench()')
+        sys.stdout.write(' >> %-20s<running>' % test)
+        sys.stdout.flush()
+        sys.stdout.write('\r    %-20s%.4f seconds\n' %
+                         (test, t.timeit(number=10) / 10))
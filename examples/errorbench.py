@@ -0,0 +1,49 @@
+"""\
+    This benchmark measures how expensive template errors are that are
+    caught and discarded by the application, for example when a fallback
+    template is rendered instead.  Pass the number of variables in the
+    context as first argument.\
+"""
+import sys
+from timeit import Timer
+from jinja2 import Environment, UndefinedError
+
+source = '\n' * 200 + '''\
+{% for item in items %}
+  {{ item.name }}
+  {% if loop.last %}{{ item.missing.attribute }}{% endif %}
+{% endfor %}
+'''
+
+count = len(sys.argv) > 1 and int(sys.argv[1]) or 100
+context = dict(('var%d' % x, x) for x in range(count))
+context['items'] = [{'name': 'item %d' % x} for x in range(10)]
+
+env = Environment()
+tmpl = env.from_string(source)
+
+
+def test_caught_error():
+    try:
+        tmpl.render(context)
+    except UndefinedError:
+        pass
+
+
+def test_formatted_error():
+    try:
+        tmpl.render(context)
+    except UndefinedError:
+        import traceback
+        traceback.format_exc()
+
+
+if __name__ == '__main__':
+    sys.stdout.write('Error Benchmark (%d context variables)\n' % count)
+    for test in 'caught_error', 'formatted_error':
+        t = Timer(setup='from __main__ import test_%s as bench' % test,
+                  stmt='bench()')
+        sys.stdout.write(' >> %-20s<running>' % test)
+        sys.stdout.flush()
+        sys.stdout.write('\r    %-20s%.4f ms\n' %
+                         (test, t.timeit(number=500) * 2))
@@ -0,0 +1,44 @@
+"""\
+    This benchmark measures how long it takes to extract the translatable
+    strings of many templates with and without a process pool and with a
+    warm extraction cache.  Pass the number of templates as first argument.\
+"""
+import sys
+from time import time
+from jinja2 import Environment, DictLoader
+from jinja2.ext import extract_from_environment
+
+snippet = """\
+{# trans: the page title #}
+<h1>{% trans %}Welcome, {{ user }}!{% endtrans %}</h1>
+{% for item in items %}
+  <p>{{ _("Item") }} {{ item.name|e }}</p>
+  {% trans count=item.count %}{{ count }} piece{% pluralize %}\
+{{ count }} pieces{% endtrans %}
+{% endfor %}
+<a href="/">{{ gettext("Back to the overview") }}</a>
+"""
+
+count = len(sys.argv) > 1 and int(sys.argv[1]) or 100
+templates = dict(('page%d.html' % x, snippet * 20 + '{# %d #}' % x)
+                 for x in range(count))
+env = Environment(loader=DictLoader(templates),
+                  extensions=['jinja2.ext.i18n'])
+
+
+def bench(**options):
+    start = time()
+    for item in extract_from_environment(env, comment_tags=['trans:'],
+                                         **options):
+        pass
+    return time() - start
+
+
+if __name__ == '__main__':
+    sys.stdout.write('Extraction Benchmark (%d templates)\n' % count)
+    cache = {}
+    for name, options in [('serial', {'processes': 1}),
+                          ('pool', {}),
+                          ('cold cache', {'cache': cache}),
+                          ('warm cache', {'cache': cache})]:
+        sys.stdout.write('    %-20s%.4f seconds\n' % (name, bench(**options)))
@@ -4,6 +4,7 @@ except ImportError:
     from profile import Profile
 from pstats import Stats
 from jinja2 import Environment as JinjaEnvironment
+from jinja2.profiler import Profiler as TemplateProfiler
 
 context = {
     'page_title': 'mitsuhiko\'s benchmark',
@@ -50,3 +51,8 @@ p.runcall(lambda: jinja_template.render(context))
 stats = Stats(p)
 stats.sort_stats('time', 'calls')
 stats.print_stats()
+
+
+p = TemplateProfiler()
+p.runcall(lambda: jinja_template.render(context))
+p.print_report()
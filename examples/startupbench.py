@@ -0,0 +1,26 @@
+"""\
+    This benchmark measures how long it takes a fresh interpreter to import
+    Jinja 2, create a package loader and load a template from it, which is
+    what every worker process of an application pays at startup.\
+"""
+import sys
+import time
+from subprocess import call
+
+script = '''\
+from jinja2 import Environment, PackageLoader
+env = Environment(loader=PackageLoader('jinja2.testsuite.res', 'templates'))
+env.get_template('test.html')
+'''
+
+count = len(sys.argv) > 1 and int(sys.argv[1]) or 20
+
+
+if __name__ == '__main__':
+    sys.stdout.write('Startup Benchmark (%d runs)\n' % count)
+    for name, code in ('interpreter', 'pass'), ('package loader', script):
+        t = time.time()
+        for x in xrange(count):
+            call([sys.executable, '-c', code])
+        sys.stdout.write('    %-20s%.4f seconds\n' %
+                         (name, (time.time() - t) / count))
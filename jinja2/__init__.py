@@ -30,12 +30,12 @@ __docformat__ = 'restructuredtext en'
 __version__ = '2.7-dev'
 
 # high level interface
-from jinja2.environment import Environment, Template
+from jinja2.environment import Environment, Template, OverlayPool
 
 # loaders
 from jinja2.loaders import BaseLoader, FileSystemLoader, PackageLoader, \
      DictLoader, FunctionLoader, PrefixLoader, ChoiceLoader, \
-     ModuleLoader
+     ModuleLoader, ArchiveLoader
 
 # bytecode caches
 from jinja2.bccache import BytecodeCache, FileSystemBytecodeCache, \
@@ -57,13 +57,14 @@ from jinja2.utils import Markup, escape, clear_caches, \
      is_undefined
 
 __all__ = [
-    'Environment', 'Template', 'BaseLoader', 'FileSystemLoader',
-    'PackageLoader', 'DictLoader', 'FunctionLoader', 'PrefixLoader',
-    'ChoiceLoader', 'BytecodeCache', 'FileSystemBytecodeCache',
-    'MemcachedBytecodeCache', 'Undefined', 'DebugUndefined',
-    'StrictUndefined', 'TemplateError', 'UndefinedError', 'TemplateNotFound',
-    'TemplatesNotFound', 'TemplateSyntaxError', 'TemplateAssertionError',
-    'ModuleLoader', 'environmentfilter', 'contextfilter', 'Markup', 'escape',
-    'environmentfunction', 'contextfunction', 'clear_caches', 'is_undefined',
-    'evalcontextfilter', 'evalcontextfunction'
+    'Environment', 'Template', 'OverlayPool', 'BaseLoader',
+    'FileSystemLoader', 'PackageLoader', 'DictLoader', 'FunctionLoader',
+    'PrefixLoader', 'ChoiceLoader', 'BytecodeCache',
+    'FileSystemBytecodeCache', 'MemcachedBytecodeCache', 'Undefined',
+    'DebugUndefined', 'StrictUndefined', 'TemplateError', 'UndefinedError',
+    'TemplateNotFound', 'TemplatesNotFound', 'TemplateSyntaxError',
+    'TemplateAssertionError', 'ModuleLoader', 'environmentfilter',
+    'contextfilter', 'Markup', 'escape', 'environmentfunction',
+    'contextfunction', 'clear_caches', 'is_undefined', 'evalcontextfilter',
+    'evalcontextfunction', 'ArchiveLoader'
 ]
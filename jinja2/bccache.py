@@ -14,17 +14,28 @@
     :copyright: (c) 2010 by the Jinja Team.
     :license: BSD.
 """
+import os
 from os import path, listdir
 import sys
+import errno
+import zlib
 import marshal
 import tempfile
 import cPickle as pickle
 import fnmatch
+from random import SystemRandom
+from types import CodeType, FunctionType, MethodType
+from weakref import WeakKeyDictionary
 try:
     from hashlib import sha1
 except ImportError:
     from sha import new as sha1
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 from jinja2.utils import open_if_exists
+from jinja2.lexer import _get_lexer_key
 
 
 # marshal works better on 3.x, one hack less required
@@ -47,7 +58,7 @@ else:
         return marshal.loads(f.read())
 
 
-bc_version = 2
+bc_version = 3
 
 # magic version used to only change with new jinja versions.  With 2.6
 # we change this to also take Python version changes into account.  The
@@ -59,6 +70,94 @@ bc_magic = 'j2'.encode('ascii') + \
     pickle.dumps((sys.version_info[0] << 24) | sys.version_info[1])
 
 
+#: the codecs buckets can be compressed with.  The values are objects with a
+#: `compress` and a `decompress` function such as the :mod:`zlib` module.
+compression_codecs = {'zlib': zlib}
+try:
+    import bz2
+except ImportError:
+    pass
+else:
+    compression_codecs['bz2'] = bz2
+
+
+# random names for temporary files and the flags they are created with.
+# they are opened with mode 0666 so that the current umask of the process
+# applies to the cache files like to any other new file.
+_random = SystemRandom()
+_tmp_flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+
+# the last fingerprint of environments together with the values it was
+# calculated from
+_fingerprints = WeakKeyDictionary()
+
+
+def _describe_code(code):
+    consts = []
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            consts.append(_describe_code(const))
+        else:
+            consts.append(repr(const))
+    return '<%r %s %s>' % (code.co_code, ', '.join(consts),
+                           ', '.join(code.co_names))
+
+
+def _describe_config_value(value, seen=None):
+    """Return a string for a configuration value that does not change
+    between processes.  Functions are described by their import path, code,
+    defaults and closure, methods by their function and the object they are
+    bound to, classes by their import path and other objects by the import
+    path of their class and their `repr`.  Objects with the default `repr`
+    include their address, they get a new description in every process.
+    """
+    if value is None or isinstance(value, (bool, int, long, float,
+                                           basestring)):
+        return repr(value)
+    if seen is None:
+        seen = set()
+    key = id(value)
+    if key in seen:
+        return '<recursion>'
+    seen.add(key)
+    try:
+        if isinstance(value, (tuple, list)):
+            return '(%s)' % ', '.join(_describe_config_value(x, seen)
+                                      for x in value)
+        if isinstance(value, dict):
+            return '{%s}' % ', '.join(sorted(
+                '%s: %s' % (_describe_config_value(k, seen),
+                            _describe_config_value(v, seen))
+                for k, v in value.iteritems()))
+        if isinstance(value, FunctionType):
+            closure = []
+            for cell in value.func_closure or ():
+                try:
+                    closure.append(cell.cell_contents)
+                except ValueError:
+                    # empty cell
+                    closure.append(None)
+            return '%s.%s%s%s%s' % (
+                value.__module__, value.__name__,
+                _describe_code(value.func_code),
+                _describe_config_value(value.func_defaults, seen),
+                _describe_config_value(closure, seen))
+        if isinstance(value, MethodType):
+            return '%s of %s' % (_describe_config_value(value.im_func, seen),
+                                 _describe_config_value(value.im_self, seen))
+        if hasattr(value, '__name__'):
+            return '%s.%s' % (getattr(value, '__module__', None),
+                              value.__name__)
+        try:
+            rv = repr(value)
+        except Exception:
+            rv = '<%x>' % id(value)
+        return '%s.%s(%s)' % (value.__class__.__module__,
+                              value.__class__.__name__, rv)
+    finally:
+        seen.discard(key)
+
+
 class Bucket(object):
     """Buckets are used to store the bytecode for one template.  It's created
     and initialized by the bytecode cache and passed to the loading functions.
@@ -66,12 +165,17 @@ class Bucket(object):
     The buckets get an internal checksum from the cache assigned and use this
     to automatically reject outdated cache material.  Individual bytecode
     cache subclasses don't have to care about cache invalidation.
+
+    If `compression` is the name of one of the :data:`compression_codecs`
+    the bytecode is written compressed.  Compressed bytecode is loaded no
+    matter what the bucket is configured to write.
     """
 
-    def __init__(self, environment, key, checksum):
+    def __init__(self, environment, key, checksum, compression=None):
         self.environment = environment
         self.key = key
         self.checksum = checksum
+        self.compression = compression
         self.reset()
 
     def reset(self):
@@ -90,7 +194,20 @@ class Bucket(object):
         if self.checksum != checksum:
             self.reset()
             return
-        self.code = marshal_load(f)
+        compression = pickle.load(f)
+        if compression is None:
+            self.code = marshal_load(f)
+            return
+        codec = compression_codecs.get(compression)
+        if codec is None:
+            self.reset()
+            return
+        try:
+            self.code = marshal.loads(codec.decompress(f.read()))
+        except Exception:
+            # truncated or corrupted data, the codecs raise different
+            # exceptions for that.
+            self.reset()
 
     def write_bytecode(self, f):
         """Dump the bytecode into the file or file like object passed."""
@@ -98,7 +215,12 @@ class Bucket(object):
             raise TypeError('can\'t write empty bucket')
         f.write(bc_magic)
         pickle.dump(self.checksum, f, 2)
-        marshal_dump(self.code, f)
+        pickle.dump(self.compression, f, 2)
+        if self.compression is None:
+            marshal_dump(self.code, f)
+        else:
+            codec = compression_codecs[self.compression]
+            f.write(codec.compress(marshal.dumps(self.code)))
 
     def bytecode_from_string(self, string):
         """Load bytecode from a string."""
@@ -138,8 +260,14 @@ class BytecodeCache(object):
 
     A more advanced version of a filesystem based bytecode cache is part of
     Jinja2.
+
+    If the :attr:`compression` attribute is set to the name of one of the
+    :data:`compression_codecs` the buckets are stored compressed.
     """
 
+    #: the name of the codec the bytecode is compressed with or `None`.
+    compression = None
+
     def load_bytecode(self, bucket):
         """Subclasses have to override this method to load bytecode into a
         bucket.  If they are not able to find code in the cache for the
@@ -170,6 +298,43 @@ class BytecodeCache(object):
             hash.update(filename)
         return hash.hexdigest()
 
+    def get_environment_fingerprint(self, environment):
+        """Returns a string that identifies the options of the environment
+        that change the code templates are compiled to (delimiters,
+        extensions, autoescaping, the filters that are called at compile
+        time etc.).  The fingerprint is part of the
+        bucket key so that environments with different options don't reuse
+        each other's bytecode.  Unlike the keys of the in-process caches it
+        is the same in every process with the same configuration, unless
+        an option refers to objects without a `repr` of their own (for
+        example in the closure of a filter).  These are told apart by their
+        address, so such environments only share bytecode within a process.
+
+        .. versionadded:: 2.7
+        """
+        extensions = []
+        for extension in environment.iter_extensions():
+            extensions.append((extension.identifier,
+                               tuple(getattr(environment, x, None) for x in
+                                     extension.config_attributes)))
+        extensions.sort()
+        config = (environment.__class__, _get_lexer_key(environment),
+                  environment.optimized, environment.finalize,
+                  environment.autoescape, extensions, environment.filters,
+                  environment.tests)
+
+        # describing all the filters takes a while, so the fingerprint is
+        # reused as long as the environment holds the same objects.
+        state = config[:6] + (environment.filters.items(),
+                              environment.tests.items())
+        cached = _fingerprints.get(environment)
+        if cached is not None and cached[0] == state:
+            return cached[1]
+        rv = _describe_config_value(config)
+        rv = sha1(rv.encode('utf-8')).hexdigest()
+        _fingerprints[environment] = (state, rv)
+        return rv
+
     def get_source_checksum(self, source):
         """Returns a checksum for the source."""
         return sha1(source.encode('utf-8')).hexdigest()
@@ -178,16 +343,73 @@ class BytecodeCache(object):
         """Return a cache bucket for the given template.  All arguments are
         mandatory but filename may be `None`.
         """
-        key = self.get_cache_key(name, filename)
-        checksum = self.get_source_checksum(source)
-        bucket = Bucket(environment, key, checksum)
+        bucket = self._make_bucket(environment, name, filename, source)
         self.load_bytecode(bucket)
         return bucket
 
+    def get_buckets(self, environment, templates):
+        """Like :meth:`get_bucket` but for an iterable of ``(name, filename,
+        source)`` tuples.  Returns a list of buckets that are loaded with one
+        call to :meth:`load_many`.
+
+        .. versionadded:: 2.7
+        """
+        fingerprint = self.get_environment_fingerprint(environment)
+        buckets = [self._make_bucket(environment, name, filename, source,
+                                     fingerprint)
+                   for name, filename, source in templates]
+        self.load_many(buckets)
+        return buckets
+
+    def _make_bucket(self, environment, name, filename, source,
+                     fingerprint=None):
+        if fingerprint is None:
+            fingerprint = self.get_environment_fingerprint(environment)
+        key = '%s|%s' % (self.get_cache_key(name, filename), fingerprint)
+        checksum = self.get_source_checksum(source)
+        return Bucket(environment, sha1(key.encode('utf-8')).hexdigest(),
+                      checksum, self.compression)
+
     def set_bucket(self, bucket):
         """Put the bucket into the cache."""
         self.dump_bytecode(bucket)
 
+    def release_bucket(self, bucket):
+        """Called by the loader when it's done with a bucket returned by
+        :meth:`get_bucket` or :meth:`get_buckets`, no matter if it was
+        stored or if compiling the template failed.  Caches that lock
+        buckets while a template is compiled can release the lock here.
+
+        .. versionadded:: 2.7
+        """
+
+    def set_buckets(self, buckets):
+        """Put a list of buckets into the cache with one call to
+        :meth:`dump_many`.
+
+        .. versionadded:: 2.7
+        """
+        self.dump_many(buckets)
+
+    def load_many(self, buckets):
+        """Loads bytecode into a list of buckets.  The default implementation
+        calls :meth:`load_bytecode` for each of them, caches that can fetch
+        multiple items at once should override this method.
+
+        .. versionadded:: 2.7
+        """
+        for bucket in buckets:
+            self.load_bytecode(bucket)
+
+    def dump_many(self, buckets):
+        """Writes the bytecode of a list of buckets back to the cache.  The
+        default implementation calls :meth:`dump_bytecode` for each of them.
+
+        .. versionadded:: 2.7
+        """
+        for bucket in buckets:
+            self.dump_bytecode(bucket)
+
 
 class FileSystemBytecodeCache(BytecodeCache):
     """A bytecode cache that stores bytecode on the filesystem.  It accepts
@@ -203,30 +425,117 @@ class FileSystemBytecodeCache(BytecodeCache):
     >>> bcc = FileSystemBytecodeCache('/tmp/jinja_cache', '%s.cache')
 
     This bytecode cache supports clearing of the cache using the clear method.
+
+    The bytecode is written to a temporary file that is renamed to the cache
+    file afterwards so that other processes never see half written files.
+    If `lock` is `True` a process that doesn't find the bytecode of a
+    template locks the cache file until it has stored the compiled code.
+    Other processes that want to load the same template wait for that and
+    load the fresh bytecode instead of compiling the template as well.
+    Locking needs the :mod:`fcntl` module and is ignored on platforms
+    without it.
+
+    .. versionchanged:: 2.7
+       The `compression` and `lock` parameters were added and the files are
+       written atomically.
     """
 
-    def __init__(self, directory=None, pattern='__jinja2_%s.cache'):
+    def __init__(self, directory=None, pattern='__jinja2_%s.cache',
+                 compression=None, lock=False):
         if directory is None:
             directory = tempfile.gettempdir()
         self.directory = directory
         self.pattern = pattern
+        self.compression = compression
+        self.lock = lock and fcntl is not None
+        # the lock is released when the bucket is dumped or released, or
+        # when the bucket of a failed load is garbage collected.
+        self._locks = WeakKeyDictionary()
 
     def _get_cache_filename(self, bucket):
         return path.join(self.directory, self.pattern % bucket.key)
 
-    def load_bytecode(self, bucket):
-        f = open_if_exists(self._get_cache_filename(bucket), 'rb')
+    def _read_bucket(self, bucket, filename):
+        f = open_if_exists(filename, 'rb')
         if f is not None:
             try:
                 bucket.load_bytecode(f)
             finally:
                 f.close()
 
+    def _load_bytecode(self, bucket, lock):
+        filename = self._get_cache_filename(bucket)
+        self._read_bucket(bucket, filename)
+        if bucket.code is not None or not lock:
+            return
+        f = open(filename + '.lock', 'a')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            # another process might have stored the bytecode while we
+            # were waiting for the lock.
+            self._read_bucket(bucket, filename)
+        except:
+            f.close()
+            raise
+        if bucket.code is not None:
+            f.close()
+        else:
+            self._locks[bucket] = f
+
+    def load_bytecode(self, bucket):
+        self._load_bytecode(bucket, self.lock)
+
+    def load_many(self, buckets):
+        # the locks are always acquired in the same order so that two
+        # processes loading the same templates can't deadlock.  Buckets
+        # with a key that appears twice are only locked once.
+        keys = set()
+        for bucket in sorted(buckets, key=lambda x: x.key):
+            self._load_bytecode(bucket, self.lock and bucket.key not in keys)
+            keys.add(bucket.key)
+
+    def _open_temp_file(self, filename):
+        while 1:
+            tmp = '%s.%016x.tmp' % (filename, _random.getrandbits(64))
+            try:
+                return os.open(tmp, _tmp_flags, 0666), tmp
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
     def dump_bytecode(self, bucket):
-        f = open(self._get_cache_filename(bucket), 'wb')
         try:
-            bucket.write_bytecode(f)
+            self._write_bucket(bucket)
         finally:
+            self.release_bucket(bucket)
+
+    def _write_bucket(self, bucket):
+        filename = self._get_cache_filename(bucket)
+        fd, tmp = self._open_temp_file(filename)
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                bucket.write_bytecode(f)
+            finally:
+                f.close()
+            try:
+                os.rename(tmp, filename)
+            except OSError:
+                # windows doesn't replace existing files on rename
+                if not path.exists(filename):
+                    raise
+                os.remove(filename)
+                os.rename(tmp, filename)
+        except:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def release_bucket(self, bucket):
+        f = self._locks.pop(bucket, None)
+        if f is not None:
             f.close()
 
     def clear(self):
@@ -234,7 +543,10 @@ class FileSystemBytecodeCache(BytecodeCache):
         # write access on the file system and the function does not exist
         # normally.
         from os import remove
-        files = fnmatch.filter(listdir(self.directory), self.pattern % '*')
+        files = []
+        for pattern in '', '.lock', '.*.tmp':
+            files.extend(fnmatch.filter(listdir(self.directory),
+                                        self.pattern % '*' + pattern))
         for filename in files:
             try:
                 remove(path.join(self.directory, filename))
@@ -276,18 +588,38 @@ class MemcachedBytecodeCache(BytecodeCache):
             Returns the value for the cache key.  If the item does not
             exist in the cache the return value must be `None`.
 
+    If the client also provides the following methods they are used to load
+    and store the bytecode of multiple templates with one request:
+
+        .. method:: get_multi(keys)
+
+            Returns a dict with the values for the keys that exist in the
+            cache.
+
+        .. method:: set_multi(mapping[, timeout])
+
+            Stores all the items of the dict in the cache.
+
     The other arguments to the constructor are the prefix for all keys that
     is added before the actual cache key and the timeout for the bytecode in
-    the cache system.  We recommend a high (or no) timeout.
+    the cache system.  We recommend a high (or no) timeout.  If many templates
+    are stored the bytecode can be compressed by passing the name of a codec
+    as `compression` (for example ``'zlib'``) to stay below the value size
+    limit of the server.
 
     This bytecode cache does not support clearing of used items in the cache.
     The clear method is a no-operation function.
+
+    .. versionchanged:: 2.7
+       The `compression` parameter was added.
     """
 
-    def __init__(self, client, prefix='jinja2/bytecode/', timeout=None):
+    def __init__(self, client, prefix='jinja2/bytecode/', timeout=None,
+                 compression=None):
         self.client = client
         self.prefix = prefix
         self.timeout = timeout
+        self.compression = compression
 
     def load_bytecode(self, bucket):
         code = self.client.get(self.prefix + bucket.key)
@@ -299,3 +631,23 @@ class MemcachedBytecodeCache(BytecodeCache):
         if self.timeout is not None:
             args += (self.timeout,)
         self.client.set(*args)
+
+    def load_many(self, buckets):
+        get_multi = getattr(self.client, 'get_multi', None)
+        if get_multi is None:
+            return BytecodeCache.load_many(self, buckets)
+        values = get_multi([self.prefix + bucket.key for bucket in buckets])
+        for bucket in buckets:
+            code = values.get(self.prefix + bucket.key)
+            if code is not None:
+                bucket.bytecode_from_string(code)
+
+    def dump_many(self, buckets):
+        set_multi = getattr(self.client, 'set_multi', None)
+        if set_multi is None:
+            return BytecodeCache.dump_many(self, buckets)
+        args = (dict((self.prefix + bucket.key, bucket.bytecode_to_string())
+                     for bucket in buckets),)
+        if self.timeout is not None:
+            args += (self.timeout,)
+        set_multi(*args)
@@ -36,6 +36,20 @@ except SyntaxError:
 else:
     have_condexpr = True
 
+# can generators delegate to other generators with ``yield from``?  If that
+# is the case blocks, includes and parent templates are passed through
+# without re-yielding every event.
+try:
+    exec 'def f():\n yield from ()'
+except SyntaxError:
+    have_yield_from = False
+else:
+    have_yield_from = True
+
+# division in the generated code needs a future import if the interpreter
+# does not use true division by default
+have_true_division = 1 / 2 == 0.5
+
 
 # what method to iterate over items do we want to use for dict iteration
 # in generated code?  on 2.x let's go with iteritems, on 3.x with items
@@ -100,6 +114,98 @@ def find_undeclared(nodes, names):
     return visitor.undeclared
 
 
+#: the names :class:`TreeAnalysis` tracks first accesses of
+special_names = frozenset(['loop', 'caller', 'kwargs', 'varargs',
+                           'self', 'super'])
+
+_empty_access = {}
+_empty_names = frozenset()
+
+
+class TreeAnalysis(object):
+    """Collects the information the code generator needs about subtrees
+    (accesses of special names, filters and tests used and assignments to
+    the special loop variable) in one walk over the tree.  The results are
+    cached by node, so asking for them again for nested constructs like
+    loops in loops doesn't walk the tree again.  The tree must not be
+    modified while the analysis is used.
+    """
+
+    def __init__(self):
+        self._cache = {}
+
+    def get(self, node):
+        """Return a ``(access, filters, tests, loop_store)`` tuple for the
+        node.  `access` maps special names to the context of their first
+        access, `loop_store` is the line number of the first assignment to
+        ``loop`` or `None`.  Except for `loop_store` the information does
+        not include nested blocks.
+        """
+        # the node is kept with the result so that its id can't be reused
+        # by another node while the analysis is around.
+        cached = self._cache.get(id(node))
+        if cached is not None and cached[0] is node:
+            return cached[1]
+        access = _empty_access
+        filters = tests = _empty_names
+        loop_store = None
+        if isinstance(node, nodes.Name):
+            if node.name in special_names:
+                access = {node.name: node.ctx}
+                if node.ctx == 'store' and node.name == 'loop':
+                    loop_store = node.lineno
+        for child in node.iter_child_nodes():
+            child_access, child_filters, child_tests, child_loop_store = \
+                self.get(child)
+            if loop_store is None:
+                loop_store = child_loop_store
+            if isinstance(child, nodes.Block):
+                continue
+            if child_access and child_access is not access:
+                if not access:
+                    access = child_access
+                else:
+                    access = dict(child_access, **access)
+            if child_filters:
+                filters = filters and filters | child_filters or child_filters
+            if child_tests:
+                tests = tests and tests | child_tests or child_tests
+        if isinstance(node, nodes.Filter):
+            filters = filters | frozenset([node.name])
+        elif isinstance(node, nodes.Test):
+            tests = tests | frozenset([node.name])
+        rv = (access, filters, tests, loop_store)
+        self._cache[id(node)] = (node, rv)
+        return rv
+
+    def find_undeclared(self, children, names):
+        """Works like :func:`find_undeclared` for special names."""
+        access = {}
+        for node in children:
+            if isinstance(node, nodes.Block):
+                continue
+            for name, ctx in self.get(node)[0].iteritems():
+                access.setdefault(name, ctx)
+        return set(name for name in names if access.get(name) == 'load')
+
+    def find_dependencies(self, children):
+        """Return the names of the filters and tests used by the nodes."""
+        filters = set()
+        tests = set()
+        for node in children:
+            if not isinstance(node, nodes.Block):
+                info = self.get(node)
+                filters.update(info[1])
+                tests.update(info[2])
+        return filters, tests
+
+    def find_loop_store(self, node):
+        """Return the line number of the first assignment to ``loop`` in
+        the node or `None`.
+        """
+        return self.get(node)[3]
+
+
 class Identifiers(object):
     """Tracks the status of identifiers in frames."""
 
@@ -229,25 +335,6 @@ class VisitorExit(RuntimeError):
     """Exception used by the `UndeclaredNameVisitor` to signal a stop."""
 
 
-class DependencyFinderVisitor(NodeVisitor):
-    """A visitor that collects filter and test calls."""
-
-    def __init__(self):
-        self.filters = set()
-        self.tests = set()
-
-    def visit_Filter(self, node):
-        self.generic_visit(node)
-        self.filters.add(node.name)
-
-    def visit_Test(self, node):
-        self.generic_visit(node)
-        self.tests.add(node.name)
-
-    def visit_Block(self, node):
-        """Stop visiting at blocks."""
-
-
 class UndeclaredNameVisitor(NodeVisitor):
     """A visitor that checks if a name is accessed without being
     declared.  This is different from the frame visitor as it will
@@ -394,10 +481,18 @@ class CodeGenerator(NodeVisitor):
         # the current line number
         self.code_lineno = 1
 
+        # the number of yield statements written so far (the dummy yields
+        # that turn functions into generators are not counted).  Useful to
+        # measure how well the optimizer merged the output.
+        self.yield_count = 0
+
         # registry of all filters and tests (global, not block local)
         self.tests = {}
         self.filters = {}
 
+        # information about the tree collected on demand
+        self.analysis = TreeAnalysis()
+
         # the debug information
         self.debug_info = []
         self._write_debug_info = None
@@ -462,6 +557,7 @@ class CodeGenerator(NodeVisitor):
         """Yield or write into the frame buffer."""
         if frame.buffer is None:
             self.writeline('yield ', node)
+            self.yield_count += 1
         else:
             self.writeline('%s.append(' % frame.buffer, node)
 
@@ -476,6 +572,35 @@ class CodeGenerator(NodeVisitor):
         self.write(s)
         self.end_write(frame)
 
+    def delegate(self, expr, frame, node=None):
+        """Pass all events of the iterable `expr` through to the frame's
+        output.  Buffers are extended in one go and on interpreters that
+        support it ``yield from`` is used, otherwise each event is yielded
+        in a loop.
+        """
+        if frame.buffer is not None:
+            self.writeline('%s.extend(%s)' % (frame.buffer, expr), node)
+            return
+        if have_yield_from:
+            self.writeline('yield from ' + expr, node)
+            self.yield_count += 1
+            return
+        self.writeline('for event in %s:' % expr, node)
+        self.indent()
+        self.simple_write('event', frame)
+        self.outdent()
+
+    def render_call(self, func, context, frame, node=None):
+        """Call the root or block render function `func` with `context`.
+        Buffered frames let the sink version of the function write into
+        the buffer directly, otherwise the events are delegated.
+        """
+        if frame.buffer is not None:
+            self.writeline('render_into(%s, %s, %s)' % (func, context,
+                                                        frame.buffer), node)
+        else:
+            self.delegate('%s(%s)' % (func, context), frame, node)
+
     def blockvisit(self, nodes, frame):
         """Visit a list of nodes as block in a frame.  If the current frame
         is no buffer a dummy ``if 0: yield None`` is written automatically
@@ -578,12 +703,10 @@ class CodeGenerator(NodeVisitor):
 
     def pull_dependencies(self, nodes):
         """Pull all the dependencies."""
-        visitor = DependencyFinderVisitor()
-        for node in nodes:
-            visitor.visit(node)
-        for dependency in 'filters', 'tests':
+        found = self.analysis.find_dependencies(nodes)
+        for dependency, names in zip(('filters', 'tests'), found):
             mapping = getattr(self, dependency)
-            for name in getattr(visitor, dependency):
+            for name in names:
                 if name not in mapping:
                     mapping[name] = self.temporary_identifier()
                 self.writeline('%s = environment.%s[%r]' %
@@ -690,7 +813,8 @@ class CodeGenerator(NodeVisitor):
         func_frame.accesses_caller = False
         func_frame.arguments = args = ['l_' + x.name for x in node.args]
 
-        undeclared = find_undeclared(children, ('caller', 'kwargs', 'varargs'))
+        undeclared = self.analysis.find_undeclared(children, ('caller',
+                                                   'kwargs', 'varargs'))
 
         if 'caller' in undeclared:
             func_frame.accesses_caller = True
@@ -761,7 +885,8 @@ class CodeGenerator(NodeVisitor):
         eval_ctx = EvalContext(self.environment, self.name)
 
         from jinja2.runtime import __all__ as exported
-        self.writeline('from __future__ import division')
+        if not have_true_division:
+            self.writeline('from __future__ import division')
         self.writeline('from jinja2.runtime import ' + ', '.join(exported))
         if not unoptimize_before_dead_code:
             self.writeline('dummy = lambda *x: None')
@@ -795,18 +920,53 @@ class CodeGenerator(NodeVisitor):
         # add the load name
         self.writeline('name = %r' % self.name)
 
+        # the render functions are generated twice.  The first version
+        # appends to the list passed as `sink` and is used by `render` and
+        # the other sink versions, the second one is the generator used for
+        # streaming.  Both share the function names so that debug and
+        # profiler output are the same for both of them.
+        self.write_render_functions(node, eval_ctx, envenv, have_extends,
+                                    'sink')
+        self.writeline('sinks = {%s}' % ', '.join(
+            ['%r: root' % None] + ['%r: block_%s' % (x, x)
+                                   for x in self.blocks]), extra=1)
+        self.write_render_functions(node, eval_ctx, envenv, have_extends)
+        self.writeline('root.sink = sinks[None]', extra=1)
+        for name in self.blocks:
+            self.writeline('block_%s.sink = sinks[%r]' % (name, name))
+
+        self.writeline('blocks = {%s}' % ', '.join('%r: block_%s' % (x, x)
+                                                   for x in self.blocks),
+                       extra=1)
+
+        # add a function that returns the debug info
+        self.writeline('debug_info = %r' % '&'.join('%s=%s' % x for x
+                                                    in self.debug_info))
+
+    def write_render_functions(self, node, eval_ctx, envenv, have_extends,
+                               sink=None):
+        """Write the root and block render functions.  If `sink` is given
+        the functions write into the list passed as second argument of that
+        name instead of yielding.
+        """
+        has_known_extends = self.has_known_extends
+        extends_so_far = self.extends_so_far
+        sink_arg = sink and ', ' + sink or ''
+
         # generate the root render function.
-        self.writeline('def root(context%s):' % envenv, extra=1)
+        self.writeline('def root(context%s%s):' % (sink_arg, envenv),
+                       extra=1)
 
         # process the root
         frame = Frame(eval_ctx)
+        frame.buffer = sink
         frame.inspect(node.body)
         frame.toplevel = frame.rootlevel = True
         frame.require_output_check = have_extends and not self.has_known_extends
         self.indent()
         if have_extends:
             self.writeline('parent_template = None')
-        if 'self' in find_undeclared(node.body, ('self',)):
+        if 'self' in self.analysis.find_undeclared(node.body, ('self',)):
             frame.identifiers.add_special('self')
             self.writeline('l_self = TemplateReference(context)')
         self.pull_locals(frame)
@@ -820,21 +980,21 @@ class CodeGenerator(NodeVisitor):
                 self.indent()
                 self.writeline('if parent_template is not None:')
             self.indent()
-            self.writeline('for event in parent_template.'
-                           'root_render_func(context):')
-            self.indent()
-            self.writeline('yield event')
-            self.outdent(2 + (not self.has_known_extends))
+            self.render_call('parent_template.root_render_func', 'context',
+                             frame)
+            self.outdent(1 + (not self.has_known_extends))
 
         # at this point we now have the blocks collected and can visit them too.
         for name, block in self.blocks.iteritems():
             block_frame = Frame(eval_ctx)
             block_frame.inspect(block.body)
             block_frame.block = name
-            self.writeline('def block_%s(context%s):' % (name, envenv),
-                           block, 1)
+            block_frame.buffer = sink
+            self.writeline('def block_%s(context%s%s):' % (name, sink_arg,
+                                                           envenv), block, 1)
             self.indent()
-            undeclared = find_undeclared(block.body, ('self', 'super'))
+            undeclared = self.analysis.find_undeclared(block.body,
+                                                       ('self', 'super'))
             if 'self' in undeclared:
                 block_frame.identifiers.add_special('self')
                 self.writeline('l_self = TemplateReference(context)')
@@ -847,13 +1007,9 @@ class CodeGenerator(NodeVisitor):
             self.blockvisit(block.body, block_frame)
             self.outdent()
 
-        self.writeline('blocks = {%s}' % ', '.join('%r: block_%s' % (x, x)
-                                                   for x in self.blocks),
-                       extra=1)
-
-        # add a function that returns the debug info
-        self.writeline('debug_info = %r' % '&'.join('%s=%s' % x for x
-                                                    in self.debug_info))
+        # the extends state is collected again by the next version
+        self.has_known_extends = has_known_extends
+        self.extends_so_far = extends_so_far
 
     def visit_Block(self, node, frame):
         """Call a block and register it for the template."""
@@ -868,11 +1024,9 @@ class CodeGenerator(NodeVisitor):
                 self.indent()
                 level += 1
         context = node.scoped and 'context.derived(locals())' or 'context'
-        self.writeline('for event in context.blocks[%r][0](%s):' % (
-                       node.name, context), node)
-        self.indent()
-        self.simple_write('event', frame)
-        self.outdent(level)
+        self.render_call('context.blocks[%r][0]' % node.name, context,
+                         frame, node)
+        self.outdent(level - 1)
 
     def visit_Extends(self, node, frame):
         """Calls the extender."""
@@ -950,15 +1104,11 @@ class CodeGenerator(NodeVisitor):
             self.indent()
 
         if node.with_context:
-            self.writeline('for event in template.root_render_func('
-                           'template.new_context(context.parent, True, '
-                           'locals())):')
+            self.render_call('template.root_render_func',
+                             'template.new_context(context.parent, True, '
+                             'locals())', frame)
         else:
-            self.writeline('for event in template.module._body_stream:')
-
-        self.indent()
-        self.simple_write('event', frame)
-        self.outdent()
+            self.delegate('template.module._body_stream', frame)
 
         if node.ignore_missing:
             self.outdent()
@@ -1049,7 +1199,7 @@ class CodeGenerator(NodeVisitor):
         # is necessary if the loop is in recursive mode if the special loop
         # variable is accessed in the body.
         extended_loop = node.recursive or 'loop' in \
-                        find_undeclared(node.iter_child_nodes(
+                        self.analysis.find_undeclared(node.iter_child_nodes(
                             only=('body',)), ('loop',))
 
         # if we don't have an recursive loop we have to find the shadowed
@@ -1069,10 +1219,10 @@ class CodeGenerator(NodeVisitor):
         # assertion error if a loop tries to write to loop
         if extended_loop:
             loop_frame.identifiers.add_special('loop')
-        for name in node.find_all(nodes.Name):
-            if name.ctx == 'store' and name.name == 'loop':
-                self.fail('Can\'t assign to special loop variable '
-                          'in for-loop target', name.lineno)
+        loop_store = self.analysis.find_loop_store(node)
+        if loop_store is not None:
+            self.fail('Can\'t assign to special loop variable '
+                      'in for-loop target', loop_store)
 
         self.pull_locals(loop_frame)
         if node.else_:
@@ -1082,7 +1232,7 @@ class CodeGenerator(NodeVisitor):
         # Create a fake parent loop if the else or test section of a
         # loop is accessing the special loop variable and no parent loop
         # exists.
-        if 'loop' not in aliases and 'loop' in find_undeclared(
+        if 'loop' not in aliases and 'loop' in self.analysis.find_undeclared(
            node.iter_child_nodes(only=('else_', 'test')), ('loop',)):
             self.writeline("l_loop = environment.undefined(%r, name='loop')" %
                 ("'loop' is undefined. the filter section of a loop as well "
@@ -1270,11 +1420,13 @@ class CodeGenerator(NodeVisitor):
                     val = repr(concat(item))
                     if frame.buffer is None:
                         self.writeline('yield ' + val)
+                        self.yield_count += 1
                     else:
                         self.writeline(val + ', ')
                 else:
                     if frame.buffer is None:
                         self.writeline('yield ', item)
+                        self.yield_count += 1
                     else:
                         self.newline(item)
                     close = 1
@@ -1308,6 +1460,7 @@ class CodeGenerator(NodeVisitor):
                     format.append('%s')
                     arguments.append(item)
             self.writeline('yield ')
+            self.yield_count += 1
             self.write(repr(concat(format)) + ' % (')
             idx = -1
             self.indent()
@@ -30,6 +30,7 @@ except SyntaxError:
     raise_helper = 'raise __jinja_exception__[1]'
 except TypeError:
     raise_helper = 'raise __jinja_exception__[0], __jinja_exception__[1]'
+raise_code = compile(raise_helper, '<template>', 'exec')
 
 
 class TracebackFrameProxy(object):
@@ -194,25 +195,94 @@ def translate_exception(exc_info, initial_skip=0):
     return ProcessedTraceback(exc_info[0], exc_info[1], frames)
 
 
+class TemplateFrameLocals(object):
+    """The locals of a faked template frame.  Calculating them requires a
+    copy of the template context, so this only happens when the locals are
+    accessed for the first time.  Most exceptions are never inspected by a
+    debugger.
+    """
+
+    def __init__(self, frame):
+        self._frame = frame
+        self._locals = None
+
+    def _get_locals(self):
+        if self._locals is None:
+            self._locals = get_template_locals(self._frame.f_locals)
+            self._frame = None
+        return self._locals
+
+    def _proxy(meth):
+        proxy = lambda self, *args: getattr(self._get_locals(), meth)(*args)
+        proxy.__doc__ = getattr(dict, meth).__doc__
+        proxy.__name__ = meth
+        return proxy
+
+    keys = _proxy('keys')
+    values = _proxy('values')
+    items = _proxy('items')
+    get = _proxy('get')
+    copy = _proxy('copy')
+    pop = _proxy('pop')
+    setdefault = _proxy('setdefault')
+    update = _proxy('update')
+    clear = _proxy('clear')
+    __iter__ = _proxy('__iter__')
+    __len__ = _proxy('__len__')
+    __contains__ = _proxy('__contains__')
+    __setitem__ = _proxy('__setitem__')
+    __delitem__ = _proxy('__delitem__')
+
+    # not available on python 3
+    if hasattr(dict, 'iterkeys'):
+        iterkeys = _proxy('iterkeys')
+        itervalues = _proxy('itervalues')
+        iteritems = _proxy('iteritems')
+    del _proxy
+
+    def __getitem__(self, key):
+        # the raise helper looks up the exception, don't calculate the
+        # locals for that.
+        if key == '__jinja_exception__':
+            raise KeyError(key)
+        return self._get_locals()[key]
+
+    def __repr__(self):
+        return repr(self._get_locals())
+
+
+# register the locals as mapping if possible
+try:
+    from collections import MutableMapping
+    MutableMapping.register(TemplateFrameLocals)
+except ImportError:
+    pass
+
+
+def get_template_locals(real_locals):
+    """Return the template variables of the locals of a template frame."""
+    ctx = real_locals.get('context')
+    if ctx:
+        locals = ctx.get_all()
+    else:
+        locals = {}
+    for name, value in real_locals.iteritems():
+        if name.startswith('l_') and value is not missing:
+            locals[name[2:]] = value
+
+    # if there is a local called __jinja_exception__, we get
+    # rid of it to not break the debug functionality.
+    locals.pop('__jinja_exception__', None)
+    return locals
+
+
 def fake_exc_info(exc_info, filename, lineno):
     """Helper for `translate_exception`."""
     exc_type, exc_value, tb = exc_info
 
-    # figure the real context out
+    # the locals are calculated lazily from the real frame
     if tb is not None:
-        real_locals = tb.tb_frame.f_locals.copy()
-        ctx = real_locals.get('context')
-        if ctx:
-            locals = ctx.get_all()
-        else:
-            locals = {}
-        for name, value in real_locals.iteritems():
-            if name.startswith('l_') and value is not missing:
-                locals[name[2:]] = value
-
-        # if there is a local called __jinja_exception__, we get
-        # rid of it to not break the debug functionality.
-        locals.pop('__jinja_exception__', None)
+        locals = TemplateFrameLocals(tb.tb_frame)
     else:
         locals = {}
 
@@ -228,29 +298,28 @@ def fake_exc_info(exc_info, filename, lineno):
         '__jinja_template__':   None
     }
 
-    # and fake the exception
-    code = compile('\n' * (lineno - 1) + raise_helper, filename, 'exec')
+    if tb is None:
+        location = 'template'
+    else:
+        function = tb.tb_frame.f_code.co_name
+        if function == 'root':
+            location = 'top-level template code'
+        elif function.startswith('block_'):
+            location = 'block "%s"' % function[6:]
+        else:
+            location = 'template'
 
-    # if it's possible, change the name of the code.  This won't work
-    # on some python environments such as google appengine
+    # and fake the exception.  If possible the raise helper is compiled only
+    # once and moved to the right line and location.  This won't work on
+    # some python environments such as google appengine
     try:
-        if tb is None:
-            location = 'template'
-        else:
-            function = tb.tb_frame.f_code.co_name
-            if function == 'root':
-                location = 'top-level template code'
-            elif function.startswith('block_'):
-                location = 'block "%s"' % function[6:]
-            else:
-                location = 'template'
-        code = CodeType(0, code.co_nlocals, code.co_stacksize,
-                        code.co_flags, code.co_code, code.co_consts,
-                        code.co_names, code.co_varnames, filename,
-                        location, code.co_firstlineno,
-                        code.co_lnotab, (), ())
+        code = CodeType(0, raise_code.co_nlocals, raise_code.co_stacksize,
+                        raise_code.co_flags, raise_code.co_code,
+                        raise_code.co_consts, raise_code.co_names,
+                        raise_code.co_varnames, filename, location, lineno,
+                        raise_code.co_lnotab, (), ())
     except:
-        pass
+        code = compile('\n' * (lineno - 1) + raise_helper, filename, 'exec')
 
     # execute the code and catch the new traceback
     try:
@@ -10,43 +10,161 @@
 """
 import os
 import sys
+from time import time
+from types import FunctionType
 from jinja2 import nodes
 from jinja2.defaults import *
-from jinja2.lexer import get_lexer, TokenStream
+from jinja2.lexer import get_lexer, TokenStream, _get_lexer_key
 from jinja2.parser import Parser
 from jinja2.optimizer import optimize
 from jinja2.compiler import generate
-from jinja2.runtime import Undefined, new_context
+from jinja2.runtime import Undefined, new_context, render_into
 from jinja2.exceptions import TemplateSyntaxError, TemplateNotFound, \
      TemplatesNotFound
 from jinja2.utils import import_string, LRUCache, Markup, missing, \
-     concat, consume, internalcode, _encode_filename
+     concat, consume, internalcode, allocate_lock, _encode_filename
 
 
 # for direct template usage we have up to ten living environments
 _spontaneous_environments = LRUCache(10)
 
+# the code of loaded templates by code cache size.  Environments with the
+# same size share the cache, it's keyed by the template and the options
+# that affect the code.  See _compile_template in the loaders module.
+_code_caches = {}
+
+# hits and misses of the spontaneous environment cache
+_spontaneous_stats = [0, 0]
+
 # the function to create jinja traceback objects.  This is dynamically
 # imported on the first exception in the exception handler.
 _make_traceback = None
 
 
+class _UnhashableConfig(Exception):
+    """Raised by :func:`make_config_key` for values it can't represent."""
+
+
+def make_config_key(value):
+    """Return a hashable key for a configuration value.  Equal keys mean that
+    environments created with the values behave the same.  Lists, dicts and
+    sets are compared by their items, functions by their code, defaults and
+    closure so that a lambda created for every template gets the same key.
+    :exc:`TypeError` is raised for values that are neither hashable nor one
+    of those.
+    """
+    try:
+        return _make_config_key(value)
+    except _UnhashableConfig:
+        raise TypeError('unhashable configuration value %r' % (value,))
+
+
+class _Identity(object):
+    """Compares a value by identity.  Holding the value keeps the id from
+    being reused.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __hash__(self):
+        return id(self.value)
+
+    def __eq__(self, other):
+        return type(other) is _Identity and other.value is self.value
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+def _get_function_state_key(value):
+    # the values a function sees can change, so they are only equal if
+    # they are the same object or hashable and equal
+    if isinstance(value, FunctionType):
+        return _make_config_key(value)
+    try:
+        hash(value)
+    except TypeError:
+        return _Identity(value)
+    return value
+
+
+def _make_config_key(value):
+    if isinstance(value, FunctionType):
+        closure = ()
+        if value.func_closure:
+            try:
+                closure = tuple(cell.cell_contents
+                                for cell in value.func_closure)
+            except ValueError:
+                # empty cell
+                raise _UnhashableConfig()
+        return (FunctionType, value.func_code, _Identity(value.func_globals),
+                tuple(_get_function_state_key(x)
+                      for x in value.func_defaults or ()),
+                tuple(_get_function_state_key(x) for x in closure))
+    elif isinstance(value, (tuple, list)):
+        return (type(value), tuple(_make_config_key(x) for x in value))
+    elif isinstance(value, (set, frozenset)):
+        return (frozenset, frozenset(_make_config_key(x) for x in value))
+    elif isinstance(value, dict):
+        return (dict, frozenset((_make_config_key(k), _make_config_key(v))
+                                for k, v in value.iteritems()))
+    try:
+        hash(value)
+    except TypeError:
+        raise _UnhashableConfig()
+    return value
+
+
 def get_spontaneous_environment(*args):
     """Return a new spontaneous environment.  A spontaneous environment is an
     unnamed and unaccessible (in theory) environment that is used for
     templates generated from a string and not from the file system.
     """
     try:
-        env = _spontaneous_environments.get(args)
-    except TypeError:
+        key = _make_config_key(args)
+    except _UnhashableConfig:
+        _spontaneous_stats[1] += 1
         return Environment(*args)
+    env = _spontaneous_environments.get(key)
     if env is not None:
+        _spontaneous_stats[0] += 1
         return env
-    _spontaneous_environments[args] = env = Environment(*args)
+    _spontaneous_stats[1] += 1
+    _spontaneous_environments[key] = env = Environment(*args)
     env.shared = True
     return env
 
 
+def spontaneous_environment_cache_info():
+    """Return a ``(hits, misses, size, capacity)`` tuple for the cache of the
+    environments created for :class:`Template` objects that are constructed
+    directly.  Many misses mean that the templates are created with
+    different options and Jinja2 has to create new environments and lexers
+    for them.
+
+    .. versionadded:: 2.7
+    """
+    return (_spontaneous_stats[0], _spontaneous_stats[1],
+            len(_spontaneous_environments),
+            _spontaneous_environments.capacity)
+
+
+def set_spontaneous_environment_cache_size(size):
+    """Change how many environments for directly constructed
+    :class:`Template` objects are kept.  The default is 10.  This also
+    clears the cache and resets the counters of
+    :func:`spontaneous_environment_cache_info`.
+
+    .. versionadded:: 2.7
+    """
+    global _spontaneous_environments
+    _spontaneous_environments = LRUCache(size)
+    _spontaneous_stats[:] = [0, 0]
+
+
 def create_cache(size):
     """Return the cache class for the given size."""
     if size == 0:
@@ -56,6 +174,16 @@ def create_cache(size):
     return LRUCache(size)
 
 
+def get_code_cache(size):
+    """Return the shared code cache for the given size."""
+    if size == 0:
+        return None
+    rv = _code_caches.get(size)
+    if rv is None:
+        rv = _code_caches[size] = create_cache(size)
+    return rv
+
+
 def copy_cache(cache):
     """Create an empty copy of the given cache."""
     if cache is None:
@@ -192,6 +320,27 @@ class Environment(object):
             have to be parsed if they were not changed.
 
             See :ref:`bytecode-cache` for more information.
+
+        `minify_whitespace`
+            If this is set to ``True`` runs of whitespace in the template
+            data are collapsed into a single space (or a single newline if
+            the run contained a line break) when the template is compiled.
+            Whitespace in ``<pre>``, ``<textarea>`` and ``<script>``
+            elements, in raw blocks and in the tags extensions list in
+            :attr:`~jinja2.ext.Extension.verbatim_tags` (like `trans`) is
+            left untouched.  Defaults to `False`.
+
+            .. versionadded:: 2.7
+
+        `code_cache_size`
+            The number of compiled templates kept by source and compile
+            options so that templates loaded again, by overlays or other
+            environments with the same settings don't have to be compiled
+            again.  Environments with the same code cache size share the
+            cache.  ``0`` disables it, ``-1`` keeps all code.  The default
+            is ``400``.
+
+            .. versionadded:: 2.7
     """
 
     #: if this environment is sandboxed.  Modifying this variable won't make
@@ -233,7 +382,9 @@ class Environment(object):
                  loader=None,
                  cache_size=50,
                  auto_reload=True,
-                 bytecode_cache=None):
+                 bytecode_cache=None,
+                 minify_whitespace=MINIFY_WHITESPACE,
+                 code_cache_size=400):
         # !!Important notice!!
         #   The constructor accepts quite a few arguments that should be
         #   passed by keyword rather than position.  However it's important to
@@ -256,6 +407,7 @@ class Environment(object):
         self.line_comment_prefix = line_comment_prefix
         self.trim_blocks = trim_blocks
         self.newline_sequence = newline_sequence
+        self.minify_whitespace = minify_whitespace
 
         # runtime information
         self.undefined = undefined
@@ -275,6 +427,13 @@ class Environment(object):
         self.bytecode_cache = bytecode_cache
         self.auto_reload = auto_reload
 
+        # code of loaded templates by name, source checksum and the options
+        # that affect the code.  The cache is shared by the environments so
+        # reloads of unchanged sources, overlays and environments with the
+        # same settings don't have to compile again.
+        self.code_cache = get_code_cache(code_cache_size)
+        self._compile_key = None
+
         # load extensions
         self.extensions = load_extensions(self, extensions)
 
@@ -303,7 +462,8 @@ class Environment(object):
                 trim_blocks=missing, extensions=missing, optimized=missing,
                 undefined=missing, finalize=missing, autoescape=missing,
                 loader=missing, cache_size=missing, auto_reload=missing,
-                bytecode_cache=missing):
+                bytecode_cache=missing, minify_whitespace=missing,
+                code_cache_size=missing):
         """Create a new overlay environment that shares all the data with the
         current environment except of cache and the overridden attributes.
         Extensions cannot be removed for an overlayed environment.  An overlayed
@@ -314,9 +474,23 @@ class Environment(object):
         up completely.  Not all attributes are truly linked, some are just
         copied over so modifications on the original environment may not shine
         through.
+
+        The :attr:`filters`, :attr:`tests` and :attr:`globals` dicts are
+        shared with the original environment, so functions added to it later
+        are available in the overlay too and modifying them on the overlay
+        modifies them for the original environment as well.  An overlay that
+        needs different ones can be given copies::
+
+            overlay = env.overlay()
+            overlay.filters = dict(env.filters, shout=shout)
+
+        Like all environments overlays reuse the code other environments
+        compiled for a template unless they change options that affect the
+        compiled code, including the filters.
         """
         args = dict(locals())
-        del args['self'], args['cache_size'], args['extensions']
+        del args['self'], args['cache_size'], args['extensions'], \
+            args['code_cache_size']
 
         rv = object.__new__(self.__class__)
         rv.__dict__.update(self.__dict__)
@@ -331,6 +505,8 @@ class Environment(object):
             rv.cache = create_cache(cache_size)
         else:
             rv.cache = copy_cache(self.cache)
+        if code_cache_size is not missing:
+            rv.code_cache = get_code_cache(code_cache_size)
 
         rv.extensions = {}
         for key, value in self.extensions.iteritems():
@@ -342,6 +518,36 @@ class Environment(object):
 
     lexer = property(get_lexer, doc="The lexer for this environment.")
 
+    def _get_compile_key(self):
+        """Return a hashable key for the options that affect the code
+        templates are compiled to or `None` if there is no such key.  The
+        filters and tests are part of the key because the optimizer calls
+        filters with constant arguments at compile time.
+
+        The key is remembered together with the values it was made from and
+        only made again if the options, extensions, filters or tests
+        changed since.  Comparing them is a lot cheaper than describing
+        every filter and test function again.
+        """
+        extensions = []
+        for extension in self.iter_extensions():
+            extensions.append((extension.identifier,
+                               tuple(getattr(self, x, None) for x in
+                                     extension.config_attributes)))
+        options = (self.__class__, _get_lexer_key(self), self.optimized,
+                   self.finalize, self.autoescape, tuple(extensions))
+        cached = self._compile_key
+        if cached is not None and cached[0] == options and \
+           cached[1] == self.filters and cached[2] == self.tests:
+            return cached[3]
+        try:
+            key = make_config_key(options + (self.filters, self.tests))
+        except TypeError:
+            key = None
+        self._compile_key = (options, dict(self.filters), dict(self.tests),
+                             key)
+        return key
+
     def iter_extensions(self):
         """Iterates over the extensions by priority."""
         return iter(sorted(self.extensions.values(),
@@ -397,6 +603,19 @@ class Environment(object):
         """Internal parsing function used by `parse` and `compile`."""
         return Parser(self, source, name, _encode_filename(filename)).parse()
 
+    def _parse_reusing(self, source, name, filename, subtrees):
+        """Parses like :meth:`_parse` but reuses the unchanged top-level
+        blocks and macros of `subtrees`.  Returns the node and the subtrees
+        of the new source.
+        """
+        try:
+            parser = Parser(self, source, name, _encode_filename(filename),
+                            subtrees=subtrees)
+            return parser.parse(), parser.subtrees
+        except TemplateSyntaxError:
+            exc_info = sys.exc_info()
+        self.handle_exception(exc_info, source_hint=source)
+
     def lex(self, source, name=None, filename=None):
         """Lex the given sourcecode and return a generator that yields
         tokens as tuples in the form ``(lineno, token_type, value)``.
@@ -647,6 +866,58 @@ class Environment(object):
             x = filter(filter_func, x)
         return x
 
+    def freeze(self, extensions=None, filter_func=None, ignore_errors=True):
+        """Loads all the templates the loader can find into the cache and
+        marks the environment as shared.  This is intended for servers that
+        fork worker processes: if the environment is frozen before the fork
+        the workers share the compiled templates with the parent process
+        instead of compiling their own copies on the first requests.
+
+        `extensions` and `filter_func` are passed to :meth:`list_templates`.
+        If `ignore_errors` is `True` (the default) files that cannot be
+        loaded as templates are skipped: templates with syntax errors, files
+        that are not in the loader's encoding and files that disappeared
+        after they were listed.  Otherwise the error is raised.
+
+        If the cache is disabled or too small to hold all templates it is
+        replaced by a cache without size limit.  Automatic reloading is
+        disabled because checking the templates for changes would defeat
+        the purpose.  If the Python interpreter supports :func:`gc.freeze`
+        the objects created so far are moved out of the reach of the garbage
+        collector so that collections in the workers do not touch (and copy)
+        their memory pages.
+
+        Freezing does not prevent later modifications of the environment,
+        but changes to the configuration that affect compilation are not
+        picked up by the templates that are already loaded.
+
+        .. versionadded:: 2.7
+        """
+        names = self.list_templates(extensions, filter_func)
+        if self.cache is None or \
+           (isinstance(self.cache, LRUCache) and
+            self.cache.capacity < len(names)):
+            cache = {}
+            if self.cache is not None:
+                cache.update(self.cache.items())
+            self.cache = cache
+        self.auto_reload = False
+
+        for name in names:
+            try:
+                self._load_template(name, self.make_globals(None))
+            except (TemplateSyntaxError, TemplateNotFound,
+                    UnicodeDecodeError):
+                if not ignore_errors:
+                    raise
+
+        self.shared = True
+
+        import gc
+        if hasattr(gc, 'freeze'):
+            gc.collect()
+            gc.freeze()
+
     def handle_exception(self, exc_info=None, rendered=False, source_hint=None):
         """Exception handling helper.  This is used internally to either raise
         rewritten exceptions or return a rendered traceback for the template.
@@ -718,6 +989,48 @@ class Environment(object):
             name = self.join_path(name, parent)
         return self._load_template(name, self.make_globals(globals))
 
+    @internalcode
+    def get_templates(self, names, parent=None, globals=None):
+        """Works like :meth:`get_template` but loads a list of templates
+        and returns them in the same order.  The templates that are not
+        in the template cache are loaded with the loader's
+        :meth:`~BaseLoader.load_many` method which looks them up in the
+        bytecode cache at once.  This is useful to warm up all the
+        templates a page needs with a single request to a bytecode cache
+        on another server such as the :class:`MemcachedBytecodeCache`.
+
+        .. versionadded:: 2.7
+        """
+        if self.loader is None:
+            raise TypeError('no loader for this environment specified')
+        globals = self.make_globals(globals)
+        rv = []
+        to_load = []
+        for name in names:
+            if isinstance(name, Template):
+                rv.append(name)
+                continue
+            if parent is not None:
+                name = self.join_path(name, parent)
+            template = None
+            if self.cache is not None:
+                template = self.cache.get(name)
+                if template is not None and self.auto_reload and \
+                   not template.is_up_to_date:
+                    template = None
+            if template is None:
+                to_load.append((len(rv), name))
+            rv.append(template)
+
+        if to_load:
+            templates = self.loader.load_many(self, [x[1] for x in to_load],
+                                              globals)
+            for (idx, name), template in zip(to_load, templates):
+                if self.cache is not None:
+                    self.cache[name] = template
+                rv[idx] = template
+        return rv
+
     @internalcode
     def select_template(self, names, parent=None, globals=None):
         """Works like :meth:`get_template` but tries a number of templates
@@ -775,6 +1088,90 @@ class Environment(object):
         return dict(self.globals, **d)
 
 
+class OverlayPool(object):
+    """Keeps overlays of an environment by key, for example one overlay
+    per tenant of an application.  `factory` is called with the environment
+    and the key to create a missing overlay and defaults to creating an
+    overlay without changes.  At most `size` overlays are kept.  If
+    `max_idle` is set overlays that were not requested for that many seconds
+    are removed::
+
+        def make_overlay(environment, tenant):
+            return environment.overlay(loader=FileSystemLoader(
+                os.path.join('tenants', tenant, 'templates')))
+
+        pool = OverlayPool(env, make_overlay, size=1000, max_idle=3600)
+        template = pool.get(tenant).get_template('index.html')
+
+    All the overlays share the compiled code of templates that did not
+    change between them.
+
+    .. versionadded:: 2.7
+    """
+
+    def __init__(self, environment, factory=None, size=100, max_idle=None):
+        if factory is None:
+            factory = lambda environment, key: environment.overlay()
+        self.environment = environment
+        self.factory = factory
+        self.max_idle = max_idle
+        self._overlays = LRUCache(size)
+        self._last_sweep = time()
+        self._lock = allocate_lock()
+
+    def get(self, key):
+        """Return the overlay for `key`, create it if necessary."""
+        now = time()
+        if self.max_idle is not None and \
+           now - self._last_sweep > self.max_idle:
+            self.evict_idle(now)
+        entry = self._overlays.get(key)
+        if entry is None:
+            self._lock.acquire()
+            try:
+                entry = self._overlays.get(key)
+                if entry is None:
+                    entry = [self.factory(self.environment, key), now]
+                    self._overlays[key] = entry
+            finally:
+                self._lock.release()
+        entry[1] = now
+        return entry[0]
+
+    def evict_idle(self, now=None):
+        """Remove the overlays that were not requested for `max_idle`
+        seconds.  This is done automatically by :meth:`get`.
+        """
+        if now is None:
+            now = time()
+        self._last_sweep = now
+        if self.max_idle is None:
+            return
+        for key, entry in self._overlays.items():
+            if now - entry[1] > self.max_idle:
+                try:
+                    del self._overlays[key]
+                except KeyError:
+                    pass
+
+    def clear(self):
+        """Remove all overlays."""
+        self._overlays.clear()
+
+    def __contains__(self, key):
+        return key in self._overlays
+
+    def __len__(self):
+        return len(self._overlays)
+
+    def __repr__(self):
+        return '<%s %d overlays of %r>' % (
+            self.__class__.__name__,
+            len(self),
+            self.environment
+        )
+
+
 class Template(object):
     """The central template object.  This class represents a compiled template
     and is used to evaluate it.
@@ -821,13 +1218,14 @@ class Template(object):
                 optimized=True,
                 undefined=Undefined,
                 finalize=None,
-                autoescape=False):
+                autoescape=False,
+                minify_whitespace=MINIFY_WHITESPACE):
         env = get_spontaneous_environment(
             block_start_string, block_end_string, variable_start_string,
             variable_end_string, comment_start_string, comment_end_string,
             line_statement_prefix, line_comment_prefix, trim_blocks,
             newline_sequence, frozenset(extensions), optimized, undefined,
-            finalize, autoescape, None, 0, False, None)
+            finalize, autoescape, None, 0, False, None, minify_whitespace)
         return env.from_string(source, template_class=cls)
 
     @classmethod
@@ -888,7 +1286,9 @@ class Template(object):
         """
         vars = dict(*args, **kwargs)
         try:
-            return concat(self.root_render_func(self.new_context(vars)))
+            buf = []
+            render_into(self.root_render_func, self.new_context(vars), buf)
+            return concat(buf)
         except Exception:
             exc_info = sys.exc_info()
         return self.environment.handle_exception(exc_info, True)
@@ -991,7 +1391,8 @@ class TemplateModule(object):
     """
 
     def __init__(self, template, context):
-        self._body_stream = list(template.root_render_func(context))
+        self._body_stream = []
+        render_into(template.root_render_func, context, self._body_stream)
         self.__dict__.update(context.get_exported())
         self.__name__ = template.name
 
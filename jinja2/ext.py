@@ -11,12 +11,18 @@
     :license: BSD.
 """
 from collections import deque
+from gettext import NullTranslations
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
 from jinja2 import nodes
 from jinja2.defaults import *
 from jinja2.environment import Environment
 from jinja2.runtime import Undefined, concat
 from jinja2.exceptions import TemplateAssertionError, TemplateSyntaxError
-from jinja2.utils import contextfunction, import_string, Markup, next
+from jinja2.utils import contextfunction, evalcontextfunction, \
+     import_string, Markup, next, LRUCache
 
 
 # the only real useful gettext functions for a Jinja template.  Note
@@ -64,6 +70,20 @@ class Extension(object):
     #: .. versionadded:: 2.4
     priority = 100
 
+    #: the tags of this extension that use the template data up to their
+    #: end tag verbatim.  The environment's `minify_whitespace` option
+    #: leaves the data between them untouched.
+    #:
+    #: .. versionadded:: 2.7
+    verbatim_tags = set()
+
+    #: the names of the environment attributes that change the code the
+    #: extension generates.  Environments that differ in one of them do not
+    #: share compiled code.
+    #:
+    #: .. versionadded:: 2.7
+    config_attributes = ()
+
     def __init__(self, environment):
         self.environment = environment
 
@@ -129,10 +149,41 @@ def _gettext_alias(__context, *args, **kwargs):
     return __context.call(__context.resolve('gettext'), *args, **kwargs)
 
 
+def _is_context_callable(func):
+    """Does `Context.call` have to pass something to the callable?"""
+    return getattr(func, 'contextfunction', False) or \
+           getattr(func, 'evalcontextfunction', False) or \
+           getattr(func, 'environmentfunction', False)
+
+
+def _make_memo_gettext(func, cache):
+    def gettext(__string):
+        rv = cache.get(__string)
+        if rv is None:
+            rv = cache[__string] = func(__string)
+        return rv
+    return gettext
+
+
+def _make_memo_ngettext(func, plural, cache):
+    def ngettext(__singular, __plural, __num):
+        # the translation depends on the plural form of the number only
+        key = (__singular, __plural, plural(__num))
+        rv = cache.get(key)
+        if rv is None:
+            rv = cache[key] = func(__singular, __plural, __num)
+        return rv
+    return ngettext
+
+
 def _make_new_gettext(func):
+    direct = not _is_context_callable(func)
     @contextfunction
     def gettext(__context, __string, **variables):
-        rv = __context.call(func, __string)
+        if direct:
+            rv = func(__string)
+        else:
+            rv = __context.call(func, __string)
         if __context.eval_ctx.autoescape:
             rv = Markup(rv)
         return rv % variables
@@ -140,10 +191,14 @@ def _make_new_gettext(func):
 
 
 def _make_new_ngettext(func):
+    direct = not _is_context_callable(func)
     @contextfunction
     def ngettext(__context, __singular, __plural, __num, **variables):
         variables.setdefault('num', __num)
-        rv = __context.call(func, __singular, __plural, __num)
+        if direct:
+            rv = func(__singular, __plural, __num)
+        else:
+            rv = __context.call(func, __singular, __plural, __num)
         if __context.eval_ctx.autoescape:
             rv = Markup(rv)
         return rv % variables
@@ -153,6 +208,20 @@ def _make_new_ngettext(func):
 class InternationalizationExtension(Extension):
     """This extension adds gettext support to Jinja2."""
     tags = set(['trans'])
+    # the data in trans blocks is used as msgid, it must not differ from
+    # the strings the extraction finds.
+    verbatim_tags = set(['trans'])
+    config_attributes = ('newstyle_gettext', 'compiled_translations')
+
+    # the environment attributes that call methods of the extension
+    environment_methods = {
+        'install_gettext_translations':     '_install',
+        'install_null_translations':        '_install_null',
+        'install_gettext_callables':        '_install_callables',
+        'uninstall_gettext_translations':   '_uninstall',
+        'extract_translations':             '_extract',
+        'get_translated_environment':       '_get_translated_environment'
+    }
 
     # TODO: the i18n extension is currently reevaluating values in a few
     # situations.  Take this example:
@@ -165,14 +234,24 @@ class InternationalizationExtension(Extension):
         Extension.__init__(self, environment)
         environment.globals['_'] = _gettext_alias
         environment.extend(
-            install_gettext_translations=self._install,
-            install_null_translations=self._install_null,
-            install_gettext_callables=self._install_callables,
-            uninstall_gettext_translations=self._uninstall,
-            extract_translations=self._extract,
-            newstyle_gettext=False
+            newstyle_gettext=False,
+            gettext_cache_size=400,
+            compiled_translations=None,
+            translated_environments={},
+            **dict((key, getattr(self, value)) for key, value
+                   in self.environment_methods.iteritems())
         )
 
+    def bind(self, environment):
+        rv = Extension.bind(self, environment)
+        # overlays copied the methods of the extension of the environment
+        # they were created from, make them work on the overlay instead.
+        for key, value in self.environment_methods.iteritems():
+            if getattr(environment, key, None) == getattr(self, value):
+                setattr(environment, key, getattr(rv, value))
+        environment.translated_environments = {}
+        return rv
+
     def _install(self, translations, newstyle=None):
         gettext = getattr(translations, 'ugettext', None)
         if gettext is None:
@@ -180,6 +259,20 @@ class InternationalizationExtension(Extension):
         ngettext = getattr(translations, 'ungettext', None)
         if ngettext is None:
             ngettext = translations.ngettext
+
+        # remember the translations of the messages so that the catalog
+        # is not asked again.  Plural forms can only be remembered if we
+        # know how the translations object picks them.
+        size = self.environment.gettext_cache_size
+        if size:
+            cache = LRUCache(size)
+            gettext = _make_memo_gettext(gettext, cache)
+            plural = getattr(translations, 'plural', None)
+            if getattr(translations, '_fallback', None) is None:
+                if plural is None and type(translations) is NullTranslations:
+                    plural = lambda n: int(n != 1)
+                if plural is not None:
+                    ngettext = _make_memo_ngettext(ngettext, plural, cache)
         self._install_callables(gettext, ngettext, newstyle)
 
     def _install_null(self, newstyle=None):
@@ -204,6 +297,46 @@ class InternationalizationExtension(Extension):
         for key in 'gettext', 'ngettext':
             self.environment.globals.pop(key, None)
 
+    def _get_translated_environment(self, locale, translations):
+        environments = self.environment.translated_environments
+        rv = environments.get(locale)
+        if rv is None or rv.compiled_translations is not translations:
+            # the compiled code depends on the translations, so the overlay
+            # must not share the bytecode cache with this environment.
+            rv = self.environment.overlay(bytecode_cache=None)
+            rv.globals = self.environment.globals.copy()
+            rv.compiled_translations = translations
+            rv.extensions[self.identifier]._install(translations)
+            environments[locale] = rv
+        return rv
+
+    def _select_plural(self, forms, singular, plural, n):
+        if forms:
+            index = self.environment.compiled_translations.plural(n)
+            if index < len(forms):
+                return forms[index]
+        # the catalog misses the form, ask the translations like
+        # ungettext does.
+        return self._ngettext(singular, plural, n)
+
+    @evalcontextfunction
+    def _format_plural(self, __eval_ctx, __forms, __singular, __plural,
+                       __num, __num_names=(), **variables):
+        for name in __num_names:
+            variables[name] = __num
+        variables.setdefault('num', __num)
+        rv = self._select_plural(__forms, __singular, __plural, __num)
+        if __eval_ctx.autoescape:
+            rv = Markup(rv)
+        return rv % variables
+
+    def _ngettext(self, singular, plural, n):
+        translations = self.environment.compiled_translations
+        ngettext = getattr(translations, 'ungettext', None)
+        if ngettext is None:
+            ngettext = translations.ngettext
+        return ngettext(singular, plural, n)
+
     def _extract(self, source, gettext_functions=GETTEXT_FUNCTIONS):
         if isinstance(source, basestring):
             source = self.environment.parse(source)
@@ -335,6 +468,12 @@ class InternationalizationExtension(Extension):
             if plural:
                 plural = plural.replace('%%', '%')
 
+        # translate at compile time if the environment was created for
+        # a specific locale
+        if self.environment.compiled_translations is not None:
+            return self._make_translated_node(singular, plural, variables,
+                                              plural_expr)
+
         # singular only:
         if plural_expr is None:
             gettext = nodes.Name('gettext', 'load')
@@ -373,6 +512,63 @@ class InternationalizationExtension(Extension):
                 ]))
         return nodes.Output([node])
 
+    def _make_translated_node(self, singular, plural, variables,
+                              plural_expr):
+        """Generates a node with the translation of the compiled translations
+        of the environment.
+        """
+        translations = self.environment.compiled_translations
+        newstyle = self.environment.newstyle_gettext
+
+        # singular only:
+        if plural_expr is None:
+            gettext = getattr(translations, 'ugettext', None)
+            if gettext is None:
+                gettext = translations.gettext
+            node = nodes.Const(gettext(singular))
+
+        # singular and plural.  Because the plural form depends on the
+        # number the translated forms are picked at runtime
+        else:
+            forms = ()
+            catalog = getattr(translations, '_catalog', None)
+            if catalog is not None and hasattr(translations, 'plural'):
+                while (singular, len(forms)) in catalog:
+                    forms += (catalog[singular, len(forms)],)
+            args = [nodes.Const(forms), nodes.Const(singular),
+                    nodes.Const(plural), plural_expr]
+
+            # newstyle gettext adds the number as `num` to the variables.
+            # The helper formats the string so that the number is only
+            # evaluated once.
+            if newstyle:
+                num_names = tuple(sorted(key for key, value in
+                                         variables.iteritems()
+                                         if value is plural_expr))
+                args.append(nodes.Const(num_names))
+                kwargs = [nodes.Keyword(key, value) for key, value
+                          in sorted(variables.items())
+                          if key not in num_names]
+                node = self.call_method('_format_plural', args, kwargs)
+                return nodes.Output([node])
+
+            if forms or catalog is None or \
+               getattr(translations, '_fallback', None) is not None:
+                node = self.call_method('_select_plural', args)
+            else:
+                node = nodes.CondExpr(
+                    nodes.Compare(plural_expr,
+                                  [nodes.Operand('eq', nodes.Const(1))]),
+                    nodes.Const(singular), nodes.Const(plural))
+
+        node = nodes.MarkSafeIfAutoescape(node)
+        if variables or newstyle:
+            node = nodes.Mod(node, nodes.Dict([
+                nodes.Pair(nodes.Const(key), value)
+                for key, value in variables.items()
+            ]))
+        return nodes.Output([node])
+
 
 class ExprStmtExtension(Extension):
     """Adds a `do` tag to Jinja2 that works like the print statement just
@@ -531,9 +727,10 @@ class _CommentFinder(object):
     def find_comments(self, lineno):
         if not self.comment_tags or self.last_lineno > lineno:
             return []
-        for idx, (token_lineno, _, _) in enumerate(self.tokens[self.offset:]):
-            if token_lineno > lineno:
-                return self.find_backwards(self.offset + idx)
+        tokens = self.tokens
+        for idx in xrange(self.offset, len(tokens)):
+            if tokens[idx][0] > lineno:
+                return self.find_backwards(idx)
         return self.find_backwards(len(self.tokens))
 
 
@@ -592,16 +789,160 @@ def babel_extract(fileobj, keywords, comment_tags, options):
         environment.newstyle_gettext = True
 
     source = fileobj.read().decode(options.get('encoding', 'utf-8'))
+    for item in _extract_from_source(environment, source, keywords,
+                                     comment_tags):
+        yield item
+
+
+def _extract_from_source(environment, source, keywords, comment_tags):
+    """Return a list of ``(lineno, funcname, message, comments)`` tuples for
+    the source.  Templates with syntax errors have no messages.
+    """
     try:
         node = environment.parse(source)
-        tokens = list(environment.lex(environment.preprocess(source)))
+        # the tokens are only necessary to find the comments
+        if comment_tags:
+            tokens = list(environment.lex(environment.preprocess(source)))
+        else:
+            tokens = []
     except TemplateSyntaxError, e:
         # skip templates with syntax errors
-        return
+        return []
 
     finder = _CommentFinder(tokens, comment_tags)
-    for lineno, func, message in extract_from_ast(node, keywords):
-        yield lineno, func, message, finder.find_comments(lineno)
+    return [(lineno, func, message, finder.find_comments(lineno))
+            for lineno, func, message in extract_from_ast(node, keywords)]
+
+
+# the environment of a process of the extraction pool
+_worker_environment = None
+
+
+def _get_syntax_config(environment):
+    """Return the configuration that affects how the environment parses
+    templates.  Unlike the environment it can be pickled.
+    """
+    return (environment.block_start_string, environment.block_end_string,
+            environment.variable_start_string,
+            environment.variable_end_string,
+            environment.comment_start_string, environment.comment_end_string,
+            environment.line_statement_prefix,
+            environment.line_comment_prefix, environment.trim_blocks,
+            environment.newline_sequence,
+            tuple(sorted(ext.identifier for ext in
+                         environment.extensions.itervalues())),
+            environment.minify_whitespace,
+            getattr(environment, 'newstyle_gettext', False))
+
+
+def _make_extract_environment(config):
+    """Create an environment for the extraction from the configuration."""
+    extensions = [import_string(x) for x in config[10]]
+    if InternationalizationExtension not in extensions:
+        extensions.append(InternationalizationExtension)
+    rv = Environment(
+        block_start_string=config[0],
+        block_end_string=config[1],
+        variable_start_string=config[2],
+        variable_end_string=config[3],
+        comment_start_string=config[4],
+        comment_end_string=config[5],
+        line_statement_prefix=config[6],
+        line_comment_prefix=config[7],
+        trim_blocks=config[8],
+        newline_sequence=config[9],
+        extensions=extensions,
+        minify_whitespace=config[11],
+        cache_size=0,
+        auto_reload=False
+    )
+    rv.newstyle_gettext = config[12]
+    return rv
+
+
+def _init_extract_worker(config):
+    global _worker_environment
+    _worker_environment = _make_extract_environment(config)
+
+
+def _extract_worker(args):
+    source, keywords, comment_tags = args
+    return _extract_from_source(_worker_environment, source, keywords,
+                                comment_tags)
+
+
+def extract_from_environment(environment, gettext_functions=GETTEXT_FUNCTIONS,
+                             comment_tags=(), extensions=None,
+                             filter_func=None, cache=None, processes=None):
+    """Extract localizable strings from all the templates of an environment.
+    The templates are found with :meth:`~Environment.list_templates`, which
+    is passed `extensions` and `filter_func`, so the loader must be able to
+    list its templates and to return their sources.
+
+    The templates are parsed by a :mod:`multiprocessing` pool of `processes`
+    processes (by default one per CPU).  If `processes` is ``1`` or
+    :mod:`multiprocessing` is not available they are parsed in this process.
+    The parsing configuration of `environment` is reused, but each process
+    has its own environment so extensions must not need configuration that
+    is not an environment argument.
+
+    `cache` can be a mapping with string keys such as a :mod:`shelve` in
+    which the messages are stored by the checksum of the template source.
+    Templates that did not change since they were extracted the last time
+    are not parsed again.
+
+    Yields ``(name, lineno, funcname, message, comments)`` tuples sorted by
+    template name.  `comments` is a list of the translator comments that
+    start with one of the `comment_tags`.  Templates with syntax errors are
+    skipped like :func:`babel_extract` does.
+
+    .. versionadded:: 2.7
+    """
+    names = environment.list_templates(extensions, filter_func)
+    comment_tags = tuple(comment_tags)
+    config = _get_syntax_config(environment)
+    options = repr((tuple(gettext_functions), comment_tags, config))
+
+    results = {}
+    missing = []
+    for name in names:
+        source = environment.loader.get_source(environment, name)[0]
+        key = sha1((options + source).encode('utf-8')).hexdigest()
+        if cache is not None:
+            messages = cache.get(key)
+            if messages is not None:
+                results[name] = messages
+                continue
+        missing.append((name, key, source))
+
+    args = [(source, gettext_functions, comment_tags)
+            for name, key, source in missing]
+    pool = None
+    if processes != 1 and len(missing) > 1:
+        try:
+            from multiprocessing import Pool
+        except ImportError:
+            pass
+        else:
+            pool = Pool(processes, _init_extract_worker, (config,))
+    if pool is not None:
+        try:
+            extracted = pool.map(_extract_worker, args)
+        finally:
+            pool.terminate()
+    else:
+        extract_environment = _make_extract_environment(config)
+        extracted = [_extract_from_source(extract_environment, *x)
+                     for x in args]
+
+    for (name, key, source), messages in zip(missing, extracted):
+        if cache is not None:
+            cache[key] = messages
+        results[name] = messages
+
+    for name in sorted(results):
+        for lineno, func, message, comments in results[name]:
+            yield name, lineno, func, message, comments
 
 
 #: nicer import names
@@ -25,6 +25,13 @@ from jinja2.utils import LRUCache, next
 # environments with the same lexer
 _lexer_cache = LRUCache(50)
 
+# lexers created with preload_lexer are never removed
+_pinned_lexers = {}
+
+# the compiled lexing rules by syntax.  Lexers that only differ in the
+# newline sequence or whitespace handling share them.
+_rules_cache = LRUCache(50)
+
 # static regular expressions
 whitespace_re = re.compile(r'\s+', re.U)
 string_re = re.compile(r"('([^'\\]*(?:\\.[^'\\]*)*)'"
@@ -44,6 +51,7 @@ else:
 
 float_re = re.compile(r'(?<!\.)\d+\.\d+')
 newline_re = re.compile(r'(\r\n|\r|\n)')
+preserve_tag_re = re.compile(r'<(/?)(pre|textarea|script)(?=[\s>/])', re.I)
 
 # internal the tokens and keep references to them
 TOKEN_ADD = intern('add')
@@ -309,6 +317,14 @@ class TokenStream(object):
         """Push a token back to the stream."""
         self._pushed.append(token)
 
+    def rewind(self, tokens):
+        """Go back to the first of `tokens`, the tokens from the current
+        token back to it in the order they were read.  The parser uses
+        this to read a statement again after looking ahead.
+        """
+        self._pushed.extendleft(reversed(tokens[1:]))
+        self.current = tokens[0]
+
     def look(self):
         """Look at the next token."""
         old_token = next(self)
@@ -372,25 +388,154 @@ class TokenStream(object):
             next(self)
 
 
+def _get_syntax_key(environment):
+    return (environment.block_start_string,
+            environment.block_end_string,
+            environment.variable_start_string,
+            environment.variable_end_string,
+            environment.comment_start_string,
+            environment.comment_end_string,
+            environment.line_statement_prefix,
+            environment.line_comment_prefix,
+            environment.trim_blocks)
+
+
+def _get_lexer_key(environment):
+    return _get_syntax_key(environment) + (
+        environment.newline_sequence,
+        environment.minify_whitespace,
+        environment.minify_whitespace and _get_verbatim_tags(environment))
+
+
+def _get_verbatim_tags(environment):
+    rv = set()
+    for extension in environment.extensions.itervalues():
+        rv.update(extension.verbatim_tags)
+    return frozenset(rv)
+
+
 def get_lexer(environment):
     """Return a lexer which is probably cached."""
-    key = (environment.block_start_string,
-           environment.block_end_string,
-           environment.variable_start_string,
-           environment.variable_end_string,
-           environment.comment_start_string,
-           environment.comment_end_string,
-           environment.line_statement_prefix,
-           environment.line_comment_prefix,
-           environment.trim_blocks,
-           environment.newline_sequence)
-    lexer = _lexer_cache.get(key)
+    key = _get_lexer_key(environment)
+    lexer = _pinned_lexers.get(key)
+    if lexer is None:
+        lexer = _lexer_cache.get(key)
+        if lexer is None:
+            lexer = Lexer(environment)
+            _lexer_cache[key] = lexer
+    return lexer
+
+
+def preload_lexer(environment):
+    """Create the lexer for the syntax of `environment` now and keep it for
+    the lifetime of the process, even if more than 50 different syntaxes are
+    used or :func:`~jinja2.clear_caches` is called.  Applications that
+    create environments (or overlays and sandboxes) with a few custom
+    syntaxes can call this at import time so that creating the environments
+    later does not compile regular expressions.  `environment` can be an
+    environment or any object with the syntax attributes of one.  The lexer
+    is returned.
+
+    .. versionadded:: 2.7
+    """
+    key = _get_lexer_key(environment)
+    lexer = _pinned_lexers.get(key)
     if lexer is None:
-        lexer = Lexer(environment)
-        _lexer_cache[key] = lexer
+        lexer = _pinned_lexers[key] = get_lexer(environment)
     return lexer
 
 
+def _make_lexer_rules(environment):
+    """Compiles the lexing rules for the syntax of the environment."""
+    # shortcuts
+    c = lambda x: re.compile(x, re.M | re.S)
+    e = re.escape
+
+    # lexing rules for tags
+    tag_rules = [
+        (whitespace_re, TOKEN_WHITESPACE, None),
+        (float_re, TOKEN_FLOAT, None),
+        (integer_re, TOKEN_INTEGER, None),
+        (name_re, TOKEN_NAME, None),
+        (string_re, TOKEN_STRING, None),
+        (operator_re, TOKEN_OPERATOR, None)
+    ]
+
+    # assemble the root lexing rule. because "|" is ungreedy
+    # we have to sort by length so that the lexer continues working
+    # as expected when we have parsing rules like <% for block and
+    # <%= for variables. (if someone wants asp like syntax)
+    # variables are just part of the rules if variable processing
+    # is required.
+    root_tag_rules = compile_rules(environment)
+
+    # block suffix if trimming is enabled
+    block_suffix_re = environment.trim_blocks and '\\n?' or ''
+
+    # global lexing rules
+    return {
+        'root': [
+            # directives
+            (c('(.*?)(?:%s)' % '|'.join(
+                [r'(?P<raw_begin>(?:\s*%s\-|%s)\s*raw\s*(?:\-%s\s*|%s))' % (
+                    e(environment.block_start_string),
+                    e(environment.block_start_string),
+                    e(environment.block_end_string),
+                    e(environment.block_end_string)
+                )] + [
+                    r'(?P<%s_begin>\s*%s\-|%s)' % (n, r, r)
+                    for n, r in root_tag_rules
+                ])), (TOKEN_DATA, '#bygroup'), '#bygroup'),
+            # data
+            (c('.+'), TOKEN_DATA, None)
+        ],
+        # comments
+        TOKEN_COMMENT_BEGIN: [
+            (c(r'(.*?)((?:\-%s\s*|%s)%s)' % (
+                e(environment.comment_end_string),
+                e(environment.comment_end_string),
+                block_suffix_re
+            )), (TOKEN_COMMENT, TOKEN_COMMENT_END), '#pop'),
+            (c('(.)'), (Failure('Missing end of comment tag'),), None)
+        ],
+        # blocks
+        TOKEN_BLOCK_BEGIN: [
+            (c('(?:\-%s\s*|%s)%s' % (
+                e(environment.block_end_string),
+                e(environment.block_end_string),
+                block_suffix_re
+            )), TOKEN_BLOCK_END, '#pop'),
+        ] + tag_rules,
+        # variables
+        TOKEN_VARIABLE_BEGIN: [
+            (c('\-%s\s*|%s' % (
+                e(environment.variable_end_string),
+                e(environment.variable_end_string)
+            )), TOKEN_VARIABLE_END, '#pop')
+        ] + tag_rules,
+        # raw block
+        TOKEN_RAW_BEGIN: [
+            (c('(.*?)((?:\s*%s\-|%s)\s*endraw\s*(?:\-%s\s*|%s%s))' % (
+                e(environment.block_start_string),
+                e(environment.block_start_string),
+                e(environment.block_end_string),
+                e(environment.block_end_string),
+                block_suffix_re
+            )), (TOKEN_DATA, TOKEN_RAW_END), '#pop'),
+            (c('(.)'), (Failure('Missing end of raw directive'),), None)
+        ],
+        # line statements
+        TOKEN_LINESTATEMENT_BEGIN: [
+            (c(r'\s*(\n|$)'), TOKEN_LINESTATEMENT_END, '#pop')
+        ] + tag_rules,
+        # line comments
+        TOKEN_LINECOMMENT_BEGIN: [
+            (c(r'(.*?)()(?=\n|$)'), (TOKEN_LINECOMMENT,
+             TOKEN_LINECOMMENT_END), '#pop')
+        ]
+    }
+
+
 class Lexer(object):
     """Class that implements a lexer for a given environment. Automatically
     created by the environment class, usually you don't have to do that.
@@ -400,100 +545,51 @@ class Lexer(object):
     """
 
     def __init__(self, environment):
-        # shortcuts
-        c = lambda x: re.compile(x, re.M | re.S)
-        e = re.escape
-
-        # lexing rules for tags
-        tag_rules = [
-            (whitespace_re, TOKEN_WHITESPACE, None),
-            (float_re, TOKEN_FLOAT, None),
-            (integer_re, TOKEN_INTEGER, None),
-            (name_re, TOKEN_NAME, None),
-            (string_re, TOKEN_STRING, None),
-            (operator_re, TOKEN_OPERATOR, None)
-        ]
-
-        # assemble the root lexing rule. because "|" is ungreedy
-        # we have to sort by length so that the lexer continues working
-        # as expected when we have parsing rules like <% for block and
-        # <%= for variables. (if someone wants asp like syntax)
-        # variables are just part of the rules if variable processing
-        # is required.
-        root_tag_rules = compile_rules(environment)
-
-        # block suffix if trimming is enabled
-        block_suffix_re = environment.trim_blocks and '\\n?' or ''
-
         self.newline_sequence = environment.newline_sequence
+        self.minify_whitespace = environment.minify_whitespace
+        self.verbatim_tags = _get_verbatim_tags(environment)
 
-        # global lexing rules
-        self.rules = {
-            'root': [
-                # directives
-                (c('(.*?)(?:%s)' % '|'.join(
-                    [r'(?P<raw_begin>(?:\s*%s\-|%s)\s*raw\s*(?:\-%s\s*|%s))' % (
-                        e(environment.block_start_string),
-                        e(environment.block_start_string),
-                        e(environment.block_end_string),
-                        e(environment.block_end_string)
-                    )] + [
-                        r'(?P<%s_begin>\s*%s\-|%s)' % (n, r, r)
-                        for n, r in root_tag_rules
-                    ])), (TOKEN_DATA, '#bygroup'), '#bygroup'),
-                # data
-                (c('.+'), TOKEN_DATA, None)
-            ],
-            # comments
-            TOKEN_COMMENT_BEGIN: [
-                (c(r'(.*?)((?:\-%s\s*|%s)%s)' % (
-                    e(environment.comment_end_string),
-                    e(environment.comment_end_string),
-                    block_suffix_re
-                )), (TOKEN_COMMENT, TOKEN_COMMENT_END), '#pop'),
-                (c('(.)'), (Failure('Missing end of comment tag'),), None)
-            ],
-            # blocks
-            TOKEN_BLOCK_BEGIN: [
-                (c('(?:\-%s\s*|%s)%s' % (
-                    e(environment.block_end_string),
-                    e(environment.block_end_string),
-                    block_suffix_re
-                )), TOKEN_BLOCK_END, '#pop'),
-            ] + tag_rules,
-            # variables
-            TOKEN_VARIABLE_BEGIN: [
-                (c('\-%s\s*|%s' % (
-                    e(environment.variable_end_string),
-                    e(environment.variable_end_string)
-                )), TOKEN_VARIABLE_END, '#pop')
-            ] + tag_rules,
-            # raw block
-            TOKEN_RAW_BEGIN: [
-                (c('(.*?)((?:\s*%s\-|%s)\s*endraw\s*(?:\-%s\s*|%s%s))' % (
-                    e(environment.block_start_string),
-                    e(environment.block_start_string),
-                    e(environment.block_end_string),
-                    e(environment.block_end_string),
-                    block_suffix_re
-                )), (TOKEN_DATA, TOKEN_RAW_END), '#pop'),
-                (c('(.)'), (Failure('Missing end of raw directive'),), None)
-            ],
-            # line statements
-            TOKEN_LINESTATEMENT_BEGIN: [
-                (c(r'\s*(\n|$)'), TOKEN_LINESTATEMENT_END, '#pop')
-            ] + tag_rules,
-            # line comments
-            TOKEN_LINECOMMENT_BEGIN: [
-                (c(r'(.*?)()(?=\n|$)'), (TOKEN_LINECOMMENT,
-                 TOKEN_LINECOMMENT_END), '#pop')
-            ]
-        }
+        # lexers that only differ in options that are applied after
+        # tokenizing share the compiled rules
+        syntax = _get_syntax_key(environment)
+        rules = _rules_cache.get(syntax)
+        if rules is None:
+            rules = _rules_cache[syntax] = _make_lexer_rules(environment)
+        self.rules = rules
 
     def _normalize_newlines(self, value):
         """Called for strings and template data to normalize it to unicode."""
         return newline_re.sub(self.newline_sequence, value)
 
+    def _minify_whitespace(self, value, preserved):
+        """Collapses runs of whitespace in template data to a single
+        space or newline.  Whitespace in ``<pre>``, ``<textarea>`` and
+        ``<script>`` elements is left untouched.  `preserved` is the name
+        of the element that is currently open (or `None`) and is returned
+        together with the new value as elements can span multiple data
+        tokens.
+        """
+        def collapse(data):
+            return whitespace_re.sub(lambda m: '\n' in m.group() and
+                                     u'\n' or u' ', data)
+        buf = []
+        pos = 0
+        for match in preserve_tag_re.finditer(value):
+            closing, tag = match.group(1), match.group(2).lower()
+            if preserved is None and not closing:
+                buf.append(collapse(value[pos:match.start()]))
+                preserved = tag
+                pos = match.start()
+            elif preserved == tag and closing:
+                buf.append(value[pos:match.end()])
+                preserved = None
+                pos = match.end()
+        if preserved is None:
+            buf.append(collapse(value[pos:]))
+        else:
+            buf.append(value[pos:])
+        return u''.join(buf), preserved
+
     def tokenize(self, source, name=None, filename=None, state=None):
         """Calls tokeniter + tokenize and wraps it in a token stream.
         """
@@ -504,6 +600,11 @@ class Lexer(object):
         """This is called with the stream as returned by `tokenize` and wraps
         every token in a :class:`Token` and converts the value.
         """
+        in_raw = False
+        # the name of the open extension tag that uses its data verbatim
+        verbatim = None
+        tag_follows = False
+        preserved = None
         for lineno, token, value in stream:
             if token in ignored_tokens:
                 continue
@@ -513,8 +614,13 @@ class Lexer(object):
                 token = 'block_end'
             # we are not interested in those tokens in the parser
             elif token in ('raw_begin', 'raw_end'):
+                in_raw = token == 'raw_begin'
                 continue
             elif token == 'data':
+                if self.minify_whitespace and not in_raw and \
+                   verbatim is None:
+                    value, preserved = self._minify_whitespace(value,
+                                                               preserved)
                 value = self._normalize_newlines(value)
             elif token == 'keyword':
                 token = value
@@ -543,6 +649,13 @@ class Lexer(object):
                 value = float(value)
             elif token == 'operator':
                 token = operators[value]
+            if tag_follows and token == 'name':
+                if verbatim is None:
+                    if value in self.verbatim_tags:
+                        verbatim = value
+                elif value == 'end' + verbatim:
+                    verbatim = None
+            tag_follows = token == 'block_begin'
             yield Token(lineno, token, value)
 
     def tokeniter(self, source, name, filename=None, state=None):
@@ -9,16 +9,26 @@
     :license: BSD, see LICENSE for more details.
 """
 import os
+import re
 import sys
+import imp
+import mmap
+import marshal
 import weakref
+from time import time
 from types import ModuleType
+from zipimport import zipimporter
 from os import path
 try:
     from hashlib import sha1
 except ImportError:
     from sha import new as sha1
 from jinja2.exceptions import TemplateNotFound
-from jinja2.utils import LRUCache, open_if_exists, internalcode
+from jinja2.utils import LRUCache, open_if_exists, internalcode, \
+     allocate_lock
+
+
+_template_module_re = re.compile(r'^(tmpl_[0-9a-f]{40})\.pyc?$')
 
 
 def split_template_path(template):
@@ -36,6 +46,50 @@ def split_template_path(template):
     return pieces
 
 
+def _compile_template(environment, name, filename, source):
+    """Compile the source of a template to a code object."""
+    # templates are reloaded whenever the uptodate function reports a
+    # change even if the source is still the same (touched files,
+    # version control checkouts) and overlays load the templates of
+    # their environment again.  Remember the code by source checksum
+    # and compile options so that it can be reused then.
+    code_cache = environment.code_cache
+    if code_cache is not None:
+        compile_key = environment._get_compile_key()
+        if compile_key is None:
+            code_cache = None
+    if code_cache is not None:
+        if isinstance(source, unicode):
+            checksum = sha1(source.encode('utf-8')).hexdigest()
+        else:
+            checksum = sha1(source).hexdigest()
+        code_key = (name, filename, checksum, compile_key)
+        code = code_cache.get(code_key)
+        if code is not None:
+            return code
+
+    if code_cache is None or not environment.auto_reload:
+        code = environment.compile(source, name, filename)
+    else:
+        # an edited template is parsed again but the top-level blocks and
+        # macros that didn't change are reused, parsed and optimized, from
+        # the last compilation.  The trees are only kept from the second
+        # compilation on, most templates are never edited.
+        subtrees_key = (name, filename, compile_key)
+        subtrees = code_cache.get(subtrees_key)
+        if subtrees is None:
+            code = environment.compile(source, name, filename)
+            subtrees = {}
+        else:
+            node, subtrees = environment._parse_reusing(source, name,
+                                                        filename, subtrees)
+            code = environment.compile(node, name, filename)
+        code_cache[subtrees_key] = subtrees
+    if code_cache is not None:
+        code_cache[code_key] = code
+    return code
+
+
 class BaseLoader(object):
     """Baseclass for all loaders.  Subclass this and override `get_source` to
     implement a custom loading mechanism.  The environment provides a
@@ -121,21 +175,68 @@ class BaseLoader(object):
             bucket = bcc.get_bucket(environment, name, filename, source)
             code = bucket.code
 
-        # if we don't have code so far (not cached, no longer up to
-        # date) etc. we compile the template
-        if code is None:
-            code = environment.compile(source, name, filename)
-
-        # if the bytecode cache is available and the bucket doesn't
-        # have a code so far, we give the bucket the new code and put
-        # it back to the bytecode cache.
-        if bcc is not None and bucket.code is None:
-            bucket.code = code
-            bcc.set_bucket(bucket)
+        try:
+            # if we don't have code so far (not cached, no longer up to
+            # date) etc. we compile the template
+            if code is None:
+                code = _compile_template(environment, name, filename, source)
+
+            # if the bytecode cache is available and the bucket doesn't
+            # have a code so far, we give the bucket the new code and put
+            # it back to the bytecode cache.
+            if bcc is not None and bucket.code is None:
+                bucket.code = code
+                bcc.set_bucket(bucket)
+        finally:
+            # the bytecode cache might keep the bucket locked until the
+            # code is stored.
+            if bcc is not None:
+                bcc.release_bucket(bucket)
 
         return environment.template_class.from_code(environment, code,
                                                     globals, uptodate)
 
+    @internalcode
+    def load_many(self, environment, names, globals=None):
+        """Loads a list of templates and returns them in the same order.
+        This works like calling :meth:`load` for each name but if a bytecode
+        cache is configured, all the templates are looked up in it with one
+        call to :meth:`~jinja2.BytecodeCache.load_many` and the ones that had
+        to be compiled are stored with one call to
+        :meth:`~jinja2.BytecodeCache.dump_many`.  Loaders that override
+        :meth:`load` load one template after another.
+
+        .. versionadded:: 2.7
+        """
+        bcc = environment.bytecode_cache
+        if bcc is None or self.__class__.load != BaseLoader.load:
+            return [self.load(environment, name, globals) for name in names]
+        if globals is None:
+            globals = {}
+
+        sources = [self.get_source(environment, name) for name in names]
+        buckets = bcc.get_buckets(environment, [
+            (name, filename, source) for name, (source, filename, uptodate)
+            in zip(names, sources)])
+
+        rv = []
+        changed = []
+        try:
+            for name, (source, filename, uptodate), bucket in \
+                    zip(names, sources, buckets):
+                if bucket.code is None:
+                    bucket.code = _compile_template(environment, name,
+                                                    filename, source)
+                    changed.append(bucket)
+                rv.append(environment.template_class.from_code(
+                    environment, bucket.code, globals, uptodate))
+            if changed:
+                bcc.set_buckets(changed)
+        finally:
+            for bucket in buckets:
+                bcc.release_bucket(bucket)
+        return rv
+
 
 class FileSystemLoader(BaseLoader):
     """Loads templates from the file system.  This loader can find templates
@@ -150,18 +251,70 @@ class FileSystemLoader(BaseLoader):
 
     Per default the template encoding is ``'utf-8'`` which can be changed
     by setting the `encoding` parameter to something else.
+
+    If `use_index` is set to `True` the loader walks the search paths once
+    and remembers which file provides which template.  Lookups are then
+    answered from memory instead of trying to open the template in every
+    search path and templates added later are not found until the index is
+    refreshed.  This happens automatically if `index_ttl` is set to the
+    number of seconds after which the index should be rebuilt, or manually
+    by calling :meth:`refresh_index` (for example from a file system
+    notification handler).
+
+    .. versionchanged:: 2.7
+       `use_index` and `index_ttl` were added.
     """
 
-    def __init__(self, searchpath, encoding='utf-8'):
+    def __init__(self, searchpath, encoding='utf-8', use_index=False,
+                 index_ttl=None):
         if isinstance(searchpath, basestring):
             searchpath = [searchpath]
         self.searchpath = list(searchpath)
         self.encoding = encoding
+        self.use_index = use_index
+        self.index_ttl = index_ttl
+        self._index = None
+        self._index_time = 0
+
+    def refresh_index(self):
+        """Rebuild the index of templates.  This is only useful if the
+        loader was created with `use_index` enabled.
+        """
+        index = {}
+        for searchpath in self.searchpath:
+            for template, filename in self._walk(searchpath):
+                if template not in index:
+                    index[template] = filename
+        self._index = index
+        self._index_time = time()
+
+    def _get_index(self):
+        if self._index is None or (self.index_ttl is not None and
+                                   time() - self._index_time > self.index_ttl):
+            self.refresh_index()
+        return self._index
+
+    def _walk(self, searchpath):
+        for dirpath, dirnames, filenames in os.walk(searchpath):
+            for filename in filenames:
+                filename = os.path.join(dirpath, filename)
+                template = filename[len(searchpath):] \
+                    .strip(os.path.sep).replace(os.path.sep, '/')
+                if template[:2] == './':
+                    template = template[2:]
+                yield template, filename
 
     def get_source(self, environment, template):
         pieces = split_template_path(template)
-        for searchpath in self.searchpath:
-            filename = path.join(searchpath, *pieces)
+        if self.use_index:
+            filename = self._get_index().get('/'.join(pieces))
+            if filename is None:
+                raise TemplateNotFound(template)
+            filenames = [filename]
+        else:
+            filenames = [path.join(searchpath, *pieces)
+                         for searchpath in self.searchpath]
+        for filename in filenames:
             f = open_if_exists(filename)
             if f is None:
                 continue
@@ -180,17 +333,12 @@ class FileSystemLoader(BaseLoader):
         raise TemplateNotFound(template)
 
     def list_templates(self):
+        if self.use_index:
+            return sorted(self._get_index())
         found = set()
         for searchpath in self.searchpath:
-            for dirpath, dirnames, filenames in os.walk(searchpath):
-                for filename in filenames:
-                    template = os.path.join(dirpath, filename) \
-                        [len(searchpath):].strip(os.path.sep) \
-                                          .replace(os.path.sep, '/')
-                    if template[:2] == './':
-                        template = template[2:]
-                    if template not in found:
-                        found.add(template)
+            for template, filename in self._walk(searchpath):
+                found.add(template)
         return sorted(found)
 
 
@@ -207,20 +355,58 @@ class PackageLoader(BaseLoader):
     by setting the `encoding` parameter to something else.  Due to the nature
     of eggs it's only possible to reload templates if the package was loaded
     from the file system and not a zip file.
+
+    Packages imported from the file system or from zip files are accessed
+    directly, `pkg_resources` is only used for other packages.
+
+    .. versionchanged:: 2.7
+       `pkg_resources` is no longer required for packages on the file
+       system and in zip files.
     """
 
     def __init__(self, package_name, package_path='templates',
                  encoding='utf-8'):
-        from pkg_resources import DefaultProvider, ResourceManager, \
-                                  get_provider
-        provider = get_provider(package_name)
         self.encoding = encoding
-        self.manager = ResourceManager()
-        self.filesystem_bound = isinstance(provider, DefaultProvider)
-        self.provider = provider
+        self.package_name = package_name
         self.package_path = package_path
+        self.provider = self.manager = None
+        self._loader = self._get_direct_loader()
+        if self._loader is None:
+            from pkg_resources import DefaultProvider, ResourceManager, \
+                                      get_provider
+            provider = get_provider(package_name)
+            self.manager = ResourceManager()
+            self.filesystem_bound = isinstance(provider, DefaultProvider)
+            self.provider = provider
+        else:
+            self.filesystem_bound = isinstance(self._loader, FileSystemLoader)
+
+    def _get_direct_loader(self):
+        """Return a loader that accesses the templates of the package
+        without `pkg_resources` or `None` if that's not possible.
+        """
+        __import__(self.package_name)
+        module = sys.modules[self.package_name]
+        filename = getattr(module, '__file__', None)
+        if not filename:
+            return None
+        pieces = split_template_path(self.package_path)
+        directory = path.dirname(filename)
+        if path.isdir(directory):
+            return FileSystemLoader(path.join(directory, *pieces),
+                                    self.encoding)
+        module_loader = getattr(module, '__loader__', None)
+        if isinstance(module_loader, zipimporter):
+            archive = module_loader.archive
+            prefix = directory[len(archive):].replace(path.sep, '/')
+            return ArchiveLoader(archive, '/'.join([prefix] + pieces),
+                                 self.encoding)
+        return None
 
     def get_source(self, environment, template):
+        if self._loader is not None:
+            return self._loader.get_source(environment, template)
+
         pieces = split_template_path(template)
         p = '/'.join((self.package_path,) + tuple(pieces))
         if not self.provider.has_resource(p):
@@ -240,6 +426,8 @@ class PackageLoader(BaseLoader):
         return source.decode(self.encoding), filename, uptodate
 
     def list_templates(self):
+        if self._loader is not None:
+            return self._loader.list_templates()
         path = self.package_path
         if path[:2] == './':
             path = path[2:]
@@ -259,6 +447,185 @@ class PackageLoader(BaseLoader):
         return results
 
 
+class _MappedFile(object):
+    """A read only file object on top of a memory map.  Unlike the map
+    itself it supports reading up to the end without a size.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.seek = data.seek
+        self.tell = data.tell
+        self.close = data.close
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.data) - self.data.tell()
+        return self.data.read(size)
+
+
+class ArchiveLoader(BaseLoader):
+    """Loads templates from a zip or tar archive.  The archive is mapped
+    into memory once and the names of its members are indexed when the
+    loader is created::
+
+        loader = ArchiveLoader('/path/to/templates.zip')
+
+    If the templates are stored in a folder of the archive the name of
+    that folder can be passed as `prefix`.  Per default the template
+    encoding is ``'utf-8'`` which can be changed by setting the `encoding`
+    parameter to something else.
+
+    The archive can also contain templates precompiled with
+    :meth:`Environment.compile_templates` (next to the sources or instead
+    of them).  If a precompiled module exists for a template it's used
+    instead of compiling the source.
+
+    Whether templates are up to date is checked by looking at the
+    modification time of the archive only.  If the archive changed it's
+    opened and indexed again.
+
+    .. versionadded:: 2.7
+    """
+
+    def __init__(self, filename, prefix='', encoding='utf-8'):
+        self.filename = filename
+        self.prefix = '/'.join(split_template_path(prefix))
+        self.encoding = encoding
+        self._lock = allocate_lock()
+        self._archive = None
+        self._open()
+
+    def _open(self):
+        import tarfile
+        from zipfile import ZipFile, BadZipfile
+
+        mtime = path.getmtime(self.filename)
+        f = open(self.filename, 'rb')
+        try:
+            data = _MappedFile(mmap.mmap(f.fileno(), 0,
+                                         access=mmap.ACCESS_READ))
+        except (EnvironmentError, ValueError):
+            # empty files or files that cannot be mapped are read normally
+            data = f
+        else:
+            f.close()
+
+        members = {}
+        prefix = self.prefix and self.prefix + '/' or ''
+        try:
+            archive = ZipFile(data)
+        except BadZipfile:
+            data.seek(0)
+            archive = tarfile.open(fileobj=data)
+            read = lambda info: archive.extractfile(info).read()
+            for info in archive.getmembers():
+                if info.isfile() and info.name.startswith(prefix):
+                    members[info.name[len(prefix):]] = info
+        else:
+            read = archive.read
+            for info in archive.infolist():
+                if info.filename.startswith(prefix) and \
+                   not info.filename.endswith('/'):
+                    members[info.filename[len(prefix):]] = info
+
+        if self._archive is not None:
+            self._close()
+        self._archive = archive
+        self._data = data
+        self._read_member = read
+        self._members = members
+        self._mtime = mtime
+        self._stale = False
+
+    def _close(self):
+        self._archive.close()
+        self._data.close()
+
+    def _read(self, member):
+        """Return the data of a member or `None` if it does not exist."""
+        # the member is looked up and read while holding the lock so that
+        # the archive can't be opened again in between.
+        self._lock.acquire()
+        try:
+            if self._stale:
+                self._open()
+            info = self._members.get(member)
+            if info is not None:
+                return self._read_member(info)
+        finally:
+            self._lock.release()
+
+    def _get_members(self):
+        if self._stale:
+            self._lock.acquire()
+            try:
+                if self._stale:
+                    self._open()
+            finally:
+                self._lock.release()
+        return self._members
+
+    def _make_uptodate(self):
+        mtime = self._mtime
+        def uptodate():
+            try:
+                current = path.getmtime(self.filename)
+            except OSError:
+                current = None
+            if current == mtime:
+                return True
+            # only open the archive again if no other template did so
+            # already for this change.
+            if current != self._mtime:
+                self._stale = True
+            return False
+        return uptodate
+
+    def _member_filename(self, member):
+        return path.join(self.filename, self.prefix, *member.split('/'))
+
+    def get_source(self, environment, template):
+        member = '/'.join(split_template_path(template))
+        source = self._read(member)
+        if source is None:
+            raise TemplateNotFound(template)
+        return (source.decode(self.encoding), self._member_filename(member),
+                self._make_uptodate())
+
+    @internalcode
+    def load(self, environment, name, globals=None):
+        key = ModuleLoader.get_template_key(name)
+        code = None
+        data = self._read(key + '.pyc')
+        if data is not None and data[:4] == imp.get_magic():
+            code = marshal.loads(data[8:])
+            filename = key + '.pyc'
+        if code is None:
+            data = self._read(key + '.py')
+            if data is None:
+                return BaseLoader.load(self, environment, name, globals)
+            filename = key + '.py'
+            code = compile(data, self._member_filename(filename), 'exec')
+        if globals is None:
+            globals = {}
+        namespace = {'__file__': self._member_filename(filename)}
+        exec code in namespace
+        rv = environment.template_class.from_module_dict(environment,
+                                                         namespace, globals)
+        rv._uptodate = self._make_uptodate()
+        return rv
+
+    def list_templates(self):
+        found = []
+        for member in self._get_members():
+            if member.startswith('tmpl_') and '/' not in member and \
+               member.endswith(('.py', '.pyc')):
+                continue
+            found.append(member)
+        return sorted(found)
+
+
 class DictLoader(BaseLoader):
     """Loads a template from a python dict.  It's passed a dict of unicode
     strings bound to template names.  This loader is useful for unittesting:
@@ -421,11 +788,21 @@ class ModuleLoader(BaseLoader):
     ... ])
 
     Templates can be precompiled with :meth:`Environment.compile_templates`.
+
+    If `preload` is set to `True` all precompiled templates found in the
+    path are imported when the loader is created and loading a template
+    is just a dictionary lookup by name.  Templates added later are not
+    found.  If this is done before a server forks its workers the modules
+    are shared with them.  Preloaded loaders also support
+    :meth:`list_templates`.
+
+    .. versionchanged:: 2.7
+       `preload` was added.
     """
 
     has_source_access = False
 
-    def __init__(self, path):
+    def __init__(self, path, preload=False):
         package_name = '_jinja2_module_templates_%x' % id(self)
 
         # create a fake module that looks for the templates in the
@@ -446,6 +823,11 @@ class ModuleLoader(BaseLoader):
         self.module = mod
         self.package_name = package_name
 
+        #: maps template names to the modules if the loader preloaded them
+        self.modules = None
+        if preload:
+            self.preload()
+
     @staticmethod
     def get_template_key(name):
         return 'tmpl_' + sha1(name.encode('utf-8')).hexdigest()
@@ -454,20 +836,65 @@ class ModuleLoader(BaseLoader):
     def get_module_filename(name):
         return ModuleLoader.get_template_key(name) + '.py'
 
-    @internalcode
-    def load(self, environment, name, globals=None):
-        key = self.get_template_key(name)
-        module = '%s.%s' % (self.package_name, key)
-        mod = getattr(self.module, module, None)
+    def _import(self, key):
+        mod = getattr(self.module, key, None)
         if mod is None:
+            module = '%s.%s' % (self.package_name, key)
             try:
                 mod = __import__(module, None, None, ['root'])
             except ImportError:
-                raise TemplateNotFound(name)
+                return None
 
             # remove the entry from sys.modules, we only want the attribute
             # on the module object we have stored on the loader.
             sys.modules.pop(module, None)
+        return mod
+
+    def _find_template_keys(self):
+        keys = set()
+        for entry in self.module.__path__:
+            if path.isdir(entry):
+                names = os.listdir(entry)
+            else:
+                from zipfile import ZipFile, is_zipfile
+                if not is_zipfile(entry):
+                    continue
+                zip_file = ZipFile(entry)
+                try:
+                    names = zip_file.namelist()
+                finally:
+                    zip_file.close()
+            for filename in names:
+                match = _template_module_re.match(filename)
+                if match is not None:
+                    keys.add(match.group(1))
+        return keys
+
+    def preload(self):
+        """Import all precompiled templates of the path now.  This is called
+        automatically if the loader was created with `preload` enabled and
+        can be called again to pick up new templates.
+        """
+        modules = {}
+        for key in self._find_template_keys():
+            mod = self._import(key)
+            if mod is not None:
+                modules[mod.name] = mod
+        self.modules = modules
+
+    def list_templates(self):
+        if self.modules is None:
+            return BaseLoader.list_templates(self)
+        return sorted(self.modules)
+
+    @internalcode
+    def load(self, environment, name, globals=None):
+        if self.modules is not None:
+            mod = self.modules.get(name)
+        else:
+            mod = self._import(self.get_template_key(name))
+        if mod is None:
+            raise TemplateNotFound(name)
 
         return environment.template_class.from_module_dict(
             environment, mod.__dict__, globals)
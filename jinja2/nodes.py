@@ -60,13 +60,18 @@ class NodeType(type):
     automatically forwarded to the child."""
 
     def __new__(cls, name, bases, d):
+        slots = []
         for attr in 'fields', 'attributes':
             storage = []
             storage.extend(getattr(bases[0], attr, ()))
             storage.extend(d.get(attr, ()))
             assert len(bases) == 1, 'multiple inheritance not allowed'
             assert len(storage) == len(set(storage)), 'layout conflict'
+            slots.extend(d.get(attr, ()))
             d[attr] = tuple(storage)
+        # nodes don't have a dict, every class only adds slots for the
+        # fields and attributes it introduces.
+        d['__slots__'] = tuple(slots)
         d.setdefault('abstract', False)
         return type.__new__(cls, name, bases, d)
 
@@ -116,7 +121,8 @@ class Node(object):
     positional arguments, attributes as keyword arguments.  Each node has
     two attributes: `lineno` (the line number of the node) and `environment`.
     The `environment` attribute is set at the end of the parsing process for
-    all nodes automatically.
+    all nodes automatically.  Nodes use slots, other attributes can't be set
+    on them.
     """
     __metaclass__ = NodeType
     fields = ()
@@ -151,21 +157,29 @@ class Node(object):
         parameter or to exclude some using the `exclude` parameter.  Both
         should be sets or tuples of field names.
         """
-        for name in self.fields:
-            if (exclude is only is None) or \
-               (exclude is not None and name not in exclude) or \
-               (only is not None and name in only):
-                try:
-                    yield name, getattr(self, name)
-                except AttributeError:
-                    pass
+        if exclude is only is None:
+            names = self.fields
+        else:
+            names = [name for name in self.fields if
+                     (exclude is not None and name not in exclude) or
+                     (only is not None and name in only)]
+        for name in names:
+            try:
+                yield name, getattr(self, name)
+            except AttributeError:
+                pass
 
     def iter_child_nodes(self, exclude=None, only=None):
         """Iterates over all direct child nodes of the node.  This iterates
         over all fields and yields the values of they are nodes.  If the value
         of a field is a list all the nodes in that list are returned.
         """
-        for field, item in self.iter_fields(exclude, only):
+        if exclude is only is None:
+            return iter(self._get_child_nodes())
+        return self._iter_child_nodes(self.iter_fields(exclude, only))
+
+    def _iter_child_nodes(self, fields):
+        for field, item in fields:
             if isinstance(item, list):
                 for n in item:
                     if isinstance(n, Node):
@@ -173,6 +187,19 @@ class Node(object):
             elif isinstance(item, Node):
                 yield item
 
+    def _get_child_nodes(self):
+        """Return a list of all direct child nodes."""
+        rv = []
+        for name in self.fields:
+            item = getattr(self, name, None)
+            if isinstance(item, list):
+                for n in item:
+                    if isinstance(n, Node):
+                        rv.append(n)
+            elif isinstance(item, Node):
+                rv.append(item)
+        return rv
+
     def find(self, node_type):
         """Find the first node of a given type.  If no such node exists the
         return value is `None`.
@@ -184,11 +211,15 @@ class Node(object):
         """Find all the nodes of a given type.  If the type is a tuple,
         the check is performed for any of the tuple items.
         """
-        for child in self.iter_child_nodes():
-            if isinstance(child, node_type):
-                yield child
-            for result in child.find_all(node_type):
-                yield result
+        todo = self._get_child_nodes()
+        todo.reverse()
+        while todo:
+            node = todo.pop()
+            if isinstance(node, node_type):
+                yield node
+            children = node._get_child_nodes()
+            children.reverse()
+            todo.extend(children)
 
     def set_ctx(self, ctx):
         """Reset the context of a node and all child nodes.  Per default the
@@ -904,6 +935,14 @@ class ScopedEvalContextModifier(EvalContextModifier):
     fields = ('body',)
 
 
+class Optimized(Helper):
+    """Wraps a statement that was optimized before, for example a block the
+    parser reused from an earlier compilation of the template.  The
+    optimizer replaces it with the wrapped node without visiting it again.
+    """
+    fields = ('node',)
+
+
 # make sure nobody creates custom nodes
 def _failing_new(*args, **kwargs):
     raise TypeError('can\'t create custom node types')
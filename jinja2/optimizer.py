@@ -27,21 +27,140 @@ def optimize(node, environment):
     return optimizer.visit(node)
 
 
+def is_static_output(node):
+    """Check if an output node only consists of template data."""
+    for child in node.nodes:
+        if not isinstance(child, nodes.TemplateData):
+            return False
+    return True
+
+
+def merge_output(body):
+    """Merge adjacent output nodes in a list of statements in place so that
+    the code generator can emit them as a single yield.  Output nodes that
+    only consist of template data are moved over assignments as those don't
+    produce any output on their own.
+    """
+    result = []
+    for node in body:
+        if isinstance(node, nodes.Output):
+            idx = len(result)
+            while idx and isinstance(result[idx - 1], nodes.Assign):
+                idx -= 1
+            if idx and isinstance(result[idx - 1], nodes.Output) and \
+               (idx == len(result) or is_static_output(result[idx - 1])):
+                prev = result.pop(idx - 1)
+                prev.nodes.extend(node.nodes)
+                result.append(prev)
+                continue
+        result.append(node)
+    body[:] = result
+
+
+def _common_prefix(a, b):
+    idx = 0
+    for idx, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return a[:idx]
+    return a[:min(len(a), len(b))]
+
+
+def _split_static(body, prefix):
+    """Split the static prefix (or suffix if `prefix` is `False`) from the
+    first (or last) statement of a body.  Returns the template data node if
+    the statement starts (or ends) with static data, `None` otherwise.
+    """
+    pos = not prefix and -1 or 0
+    if not body or not isinstance(body[pos], nodes.Output):
+        return None
+    output = body[pos]
+    if not output.nodes:
+        return None
+    data = output.nodes[pos]
+    if isinstance(data, nodes.TemplateData):
+        return data
+
+
+def _strip_static(body, length, prefix):
+    """Remove `length` characters from the static prefix or suffix of
+    the body as found by :func:`_split_static`.
+    """
+    pos = not prefix and -1 or 0
+    output = body[pos]
+    data = output.nodes[pos]
+    if prefix:
+        data.data = data.data[length:]
+    else:
+        data.data = data.data[:len(data.data) - length]
+    if not data.data:
+        output.nodes.remove(data)
+        if not output.nodes:
+            body.remove(output)
+
+
+def hoist_static_data(node):
+    """If both branches of an if statement start or end with the same
+    template data, that data is moved out of the condition so that it
+    can be merged with the surrounding output.  Returns either the node
+    or a list of nodes.
+    """
+    if not node.body or not node.else_:
+        return node
+    rv = [node]
+    for prefix in True, False:
+        a = _split_static(node.body, prefix)
+        b = _split_static(node.else_, prefix)
+        if a is None or b is None:
+            continue
+        if prefix:
+            common = _common_prefix(a.data, b.data)
+        else:
+            common = _common_prefix(a.data[::-1], b.data[::-1])[::-1]
+        if not common:
+            continue
+        _strip_static(node.body, len(common), prefix)
+        _strip_static(node.else_, len(common), prefix)
+        static = nodes.Output([nodes.TemplateData(common, lineno=a.lineno,
+                                                  environment=a.environment)],
+                              lineno=a.lineno, environment=a.environment)
+        if prefix:
+            rv.insert(0, static)
+        else:
+            rv.append(static)
+        # a branch that was consumed completely by the prefix has no
+        # suffix left to share
+        if not node.body or not node.else_:
+            break
+    if len(rv) == 1:
+        return node
+    return rv
+
+
 class Optimizer(NodeTransformer):
 
     def __init__(self, environment):
         self.environment = environment
 
+    def generic_visit(self, node, *args, **kwargs):
+        node = NodeTransformer.generic_visit(self, node, *args, **kwargs)
+        for field, value in node.iter_fields():
+            if isinstance(value, list):
+                merge_output(value)
+        return node
+
+    def visit_Optimized(self, node):
+        return node.node
+
     def visit_If(self, node):
         """Eliminate dead code."""
         # do not optimize ifs that have a block inside so that it doesn't
         # break super().
         if node.find(nodes.Block) is not None:
-            return self.generic_visit(node)
+            return hoist_static_data(self.generic_visit(node))
         try:
             val = self.visit(node.test).as_const()
         except nodes.Impossible:
-            return self.generic_visit(node)
+            return hoist_static_data(self.generic_visit(node))
         if val:
             body = node.body
         else:
@@ -8,6 +8,10 @@
     :copyright: (c) 2010 by the Jinja Team.
     :license: BSD, see LICENSE for more details.
 """
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
 from jinja2 import nodes
 from jinja2.exceptions import TemplateSyntaxError, TemplateAssertionError
 from jinja2.utils import next
@@ -19,15 +23,42 @@ _statement_keywords = frozenset(['for', 'if', 'block', 'extends', 'print',
                                  'macro', 'include', 'from', 'import',
                                  'set'])
 _compare_operators = frozenset(['eq', 'ne', 'lt', 'lteq', 'gt', 'gteq'])
+#: top-level statements the parser can reuse from an earlier parse
+_reusable_statements = frozenset(['block', 'macro'])
+
+
+def _copy_node(node, offset):
+    """Copy a tree of nodes and move its line numbers by `offset`."""
+    rv = object.__new__(node.__class__)
+    for name in node.fields:
+        try:
+            value = getattr(node, name)
+        except AttributeError:
+            continue
+        if isinstance(value, nodes.Node):
+            value = _copy_node(value, offset)
+        elif isinstance(value, list):
+            value = [isinstance(x, nodes.Node) and _copy_node(x, offset) or x
+                     for x in value]
+        setattr(rv, name, value)
+    rv.lineno = node.lineno is not None and node.lineno + offset or None
+    rv.environment = node.environment
+    return rv
 
 
 class Parser(object):
     """This is the central parsing class Jinja2 uses.  It's passed to
     extensions and can be used to parse expressions or statements.
+
+    If `subtrees` is given the parser reuses the nodes of top-level blocks
+    and macros whose tokens didn't change since an earlier parse.  It's the
+    :attr:`subtrees` attribute of the parser that did that parse after its
+    template was compiled, so the nodes are optimized already if the
+    environment optimizes.  Reused nodes must not be modified.
     """
 
     def __init__(self, environment, source, name=None, filename=None,
-                 state=None):
+                 state=None, subtrees=None):
         self.environment = environment
         self.stream = environment._tokenize(source, name, filename, state)
         self.name = name
@@ -40,6 +71,12 @@ class Parser(object):
         self._last_identifier = 0
         self._tag_stack = []
         self._end_token_stack = []
+        self._reusable_subtrees = subtrees
+        #: if reusing is enabled a dict of the top-level blocks and macros
+        #: of the source by the hash of their tokens.
+        self.subtrees = None
+        if subtrees is not None:
+            self.subtrees = {}
 
     def fail(self, msg, lineno=None, exc=TemplateSyntaxError):
         """Convenience method that raises `exc` with the message, passed
@@ -138,6 +175,55 @@ class Parser(object):
             if pop_tag:
                 self._tag_stack.pop()
 
+    def _parse_reusable_statement(self):
+        """Parse a top-level block or macro or reuse the node of an earlier
+        parse if the tokens of the statement are the same.  The line numbers
+        of the tokens are taken relative to the first one, so statements
+        that only moved are reused too.
+        """
+        start = self.stream.current
+        keyword = start.value
+        depth = 1
+        tokens = [start]
+        last_type = start.type
+        while 1:
+            next(self.stream)
+            token = self.stream.current
+            tokens.append(token)
+            if token.type == 'eof':
+                # an unclosed statement, let the regular parsing fail
+                self.stream.rewind(tokens)
+                return self.parse_statement()
+            if last_type == 'block_begin' and token.type == 'name':
+                if token.value == keyword:
+                    depth += 1
+                elif token.value == 'end' + keyword:
+                    depth -= 1
+            elif token.type == 'block_end' and not depth:
+                break
+            last_type = token.type
+
+        key = sha1(repr([(x.lineno - start.lineno, x.type, x.value)
+                         for x in tokens]).encode('utf-8')).hexdigest()
+        reused = self._reusable_subtrees.get(key)
+        if reused is not None:
+            lineno, node = reused
+            if lineno != start.lineno:
+                node = _copy_node(node, start.lineno - lineno)
+            self.subtrees[key] = (start.lineno, node)
+            if self.environment.optimized:
+                return nodes.Optimized(node, lineno=start.lineno)
+            return node
+
+        self.stream.rewind(tokens)
+        node = self.parse_statement()
+        # extensions may create identifiers that are only free in this
+        # parse, and the statement must have ended where the tokens did.
+        if self.stream.current is token and \
+           node.find(nodes.InternalName) is None:
+            self.subtrees[key] = (start.lineno, node)
+        return node
+
     def parse_statements(self, end_tokens, drop_needle=False):
         """Parse multiple statements into a list until one of the end tokens
         is reached.  This is used to parse the body of statements as it also
@@ -872,7 +958,13 @@ class Parser(object):
                     if end_tokens is not None and \
                        self.stream.current.test_any(*end_tokens):
                         return body
-                    rv = self.parse_statement()
+                    if self.subtrees is not None and \
+                       end_tokens is None and not self._tag_stack and \
+                       self.stream.current.type == 'name' and \
+                       self.stream.current.value in _reusable_statements:
+                        rv = self._parse_reusable_statement()
+                    else:
+                        rv = self.parse_statement()
                     if isinstance(rv, list):
                         body.extend(rv)
                     else:
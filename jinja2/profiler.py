@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+    jinja2.profiler
+    ~~~~~~~~~~~~~~~
+
+    A profiler that reports the time spent rendering templates against
+    templates, blocks, macros and template source lines instead of the
+    generated Python code.
+
+    :copyright: (c) 2010 by the Jinja Team.
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import time
+import marshal
+from jinja2.runtime import Macro
+
+
+_sort_keys = {
+    'calls':        lambda x: x[1][0],
+    'time':         lambda x: x[1][1],
+    'cumulative':   lambda x: x[1][2]
+}
+
+
+class Profiler(object):
+    """Records the wall time and the number of calls of templates, blocks
+    and macros as well as the time spent on each template source line.  The
+    profiler only looks at frames of compiled templates, so everything else
+    that happens while rendering (filters, tests, functions called from the
+    template) is accounted to the template line that caused it.
+
+    The profiler can be used as context manager::
+
+        profiler = Profiler()
+        with profiler:
+            template.render(...)
+        print profiler.report()
+
+    Only the thread that enabled the profiler is profiled.  The collected
+    data can also be passed to :class:`pstats.Stats` or written to a file in
+    the format of the :mod:`profile` module with :meth:`dump_stats`.
+
+    .. versionadded:: 2.7
+    """
+
+    def __init__(self, timer=None):
+        if timer is None:
+            if sys.platform == 'win32':
+                timer = time.clock
+            else:
+                timer = time.time
+        self.timer = timer
+        self.stats = {}
+        self._old_trace = None
+        self._labels = {}
+        self._lines = {}
+        self._stack = []
+        self.clear()
+
+    def clear(self):
+        """Forget everything recorded so far."""
+        #: maps ``(template, kind, name, filename, lineno)`` tuples to
+        #: ``[calls, self_time, total_time]`` lists.
+        self.functions = {}
+        #: maps ``(template, lineno)`` tuples to ``[hits, time]`` lists.
+        self.lines = {}
+
+    def enable(self):
+        """Start collecting data."""
+        self._old_trace = sys.gettrace()
+        sys.settrace(self._trace_call)
+
+    def disable(self):
+        """Stop collecting data."""
+        sys.settrace(self._old_trace)
+        self._old_trace = None
+        del self._stack[:]
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.disable()
+
+    def runcall(self, func, *args, **kwargs):
+        """Profile a single call of `func` and return its return value."""
+        self.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.disable()
+
+    def _describe(self, frame, template):
+        code = frame.f_code
+        rv = self._labels.get(code)
+        if rv is not None:
+            return rv
+        name = code.co_name
+        if name == 'root':
+            kind = 'template'
+            name = template.name
+        elif name.startswith('block_'):
+            kind = 'block'
+            name = name[6:]
+        else:
+            kind = 'macro'
+            caller = frame.f_back
+            if caller is not None and caller.f_code.co_name == '__call__':
+                macro = caller.f_locals.get('self')
+                if isinstance(macro, Macro):
+                    name = macro.name
+        rv = self._labels[code] = (
+            template.name or '<template>', kind, name,
+            template.filename or '<template>',
+            template.get_corresponding_lineno(code.co_firstlineno)
+        )
+        return rv
+
+    def _get_line(self, frame, template):
+        key = (frame.f_code, frame.f_lineno)
+        rv = self._lines.get(key)
+        if rv is None:
+            rv = self._lines[key] = (template.name or '<template>',
+                                     template.get_corresponding_lineno(
+                                         frame.f_lineno))
+        return rv
+
+    def _record_line(self, entry, now):
+        if entry[3] is not None:
+            stats = self.lines.get(entry[3])
+            if stats is None:
+                stats = self.lines[entry[3]] = [0, 0.0]
+            stats[1] += now - entry[4]
+
+    def _trace_call(self, frame, event, arg):
+        template = frame.f_globals.get('__jinja_template__')
+        if event != 'call' or template is None:
+            return None
+        now = self.timer()
+        info = self._describe(frame, template)
+        stats = self.functions.get(info)
+        if stats is None:
+            stats = self.functions[info] = [0, 0.0, 0.0]
+        # generators trigger a call event every time they are resumed,
+        # only count the first one
+        if frame.f_lasti < 0:
+            stats[0] += 1
+            line = None
+        else:
+            line = self._get_line(frame, template)
+        # [function stats, start, time in children, line, line start]
+        self._stack.append([stats, now, 0.0, line, now])
+        return self._trace_local
+
+    def _trace_local(self, frame, event, arg):
+        if not self._stack:
+            return None
+        if event == 'line':
+            now = self.timer()
+            entry = self._stack[-1]
+            self._record_line(entry, now)
+            line = self._get_line(frame, frame.f_globals['__jinja_template__'])
+            # one template line usually spans more than one line of
+            # generated code, count a hit only if the template line changed
+            if line != entry[3]:
+                stats = self.lines.get(line)
+                if stats is None:
+                    stats = self.lines[line] = [0, 0.0]
+                stats[0] += 1
+                entry[3] = line
+            entry[4] = now
+        elif event == 'return':
+            now = self.timer()
+            entry = self._stack.pop()
+            self._record_line(entry, now)
+            elapsed = now - entry[1]
+            entry[0][1] += elapsed - entry[2]
+            entry[0][2] += elapsed
+            if self._stack:
+                self._stack[-1][2] += elapsed
+        return self._trace_local
+
+    def create_stats(self):
+        """Convert the collected data into the format used by the
+        :mod:`pstats` module and store it in :attr:`stats`.  This is
+        called by :class:`pstats.Stats` if a profiler is passed to it.
+        """
+        self.stats = {}
+        for (template, kind, name, filename, lineno), (calls, tt, ct) \
+                in self.functions.iteritems():
+            if kind == 'template':
+                label = 'template %s' % template
+            else:
+                label = '%s %s' % (kind, name)
+            self.stats[filename, lineno, label] = (calls, calls, tt, ct, {})
+
+    def dump_stats(self, filename):
+        """Write the collected data into a file that can be loaded with
+        :class:`pstats.Stats`.
+        """
+        self.create_stats()
+        f = open(filename, 'wb')
+        try:
+            marshal.dump(self.stats, f)
+        finally:
+            f.close()
+
+    def iter_functions(self, sort='time'):
+        """Iterate over the templates, blocks and macros sorted by `sort`
+        which can be ``'time'`` (time spent in the function itself),
+        ``'cumulative'`` or ``'calls'``.  Yields ``(info, stats)`` tuples
+        where info is a ``(template, kind, name, filename, lineno)`` tuple
+        and stats a ``[calls, time, cumulative_time]`` list.
+        """
+        return iter(sorted(self.functions.iteritems(),
+                           key=_sort_keys[sort], reverse=True))
+
+    def iter_lines(self, sort='time'):
+        """Iterate over ``((template, lineno), [hits, time])`` tuples.
+        `sort` can be ``'time'`` or ``'calls'``.
+        """
+        return iter(sorted(self.lines.iteritems(),
+                           key=_sort_keys[sort], reverse=True))
+
+    def report(self, sort='time', limit=None):
+        """Return a text report of the collected data sorted by `sort`.  If
+        `limit` is given only that many functions and lines are shown.
+        """
+        buf = ['%-50s %8s %10s %10s' % ('function', 'calls', 'time',
+                                         'cumulative')]
+        for idx, ((template, kind, name, filename, lineno),
+                  (calls, tt, ct)) in enumerate(self.iter_functions(sort)):
+            if limit is not None and idx >= limit:
+                break
+            if kind == 'template':
+                label = 'template %s' % template
+            else:
+                label = '%s %s (%s:%d)' % (kind, name, template, lineno)
+            buf.append('%-50s %8d %10.6f %10.6f' % (label, calls, tt, ct))
+        line_sort = sort == 'cumulative' and 'time' or sort
+        buf.append('')
+        buf.append('%-50s %8s %10s' % ('line', 'hits', 'time'))
+        for idx, ((template, lineno), (hits, tt)) in \
+                enumerate(self.iter_lines(line_sort)):
+            if limit is not None and idx >= limit:
+                break
+            buf.append('%-50s %8d %10.6f' % ('%s:%d' % (template, lineno),
+                                              hits, tt))
+        return '\n'.join(buf)
+
+    def print_report(self, sort='time', limit=None, stream=None):
+        """Write the report returned by :meth:`report` to `stream` which
+        defaults to `sys.stdout`.
+        """
+        if stream is None:
+            stream = sys.stdout
+        stream.write(self.report(sort, limit) + '\n')
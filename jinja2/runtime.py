@@ -20,7 +20,7 @@ from jinja2.exceptions import UndefinedError, TemplateRuntimeError, \
 __all__ = ['LoopContext', 'TemplateReference', 'Macro', 'Markup',
            'TemplateRuntimeError', 'missing', 'concat', 'escape',
            'markup_join', 'unicode_join', 'to_string', 'identity',
-           'TemplateNotFound']
+           'TemplateNotFound', 'render_into']
 
 #: the name of the function that is used to convert something into
 #: a string.  2to3 will adopt that automatically and the generated
@@ -47,6 +47,18 @@ def unicode_join(seq):
     return concat(imap(unicode, seq))
 
 
+def render_into(func, context, sink):
+    """Render the root or block render function `func` into the list `sink`.
+    The compiler attaches a version of the function that appends to the
+    sink directly, functions without one are iterated.
+    """
+    sink_func = getattr(func, 'sink', None)
+    if sink_func is not None:
+        sink_func(context, sink)
+    else:
+        sink.extend(func(context))
+
+
 def new_context(environment, template_name, blocks, vars=None,
                 shared=None, globals=None, locals=None):
     """Internal helper to for context creation."""
@@ -258,7 +270,9 @@ class BlockReference(object):
 
     @internalcode
     def __call__(self):
-        rv = concat(self._stack[self._depth](self._context))
+        buf = []
+        render_into(self._stack[self._depth], self._context, buf)
+        rv = concat(buf)
         if self._context.eval_ctx.autoescape:
             rv = Markup(rv)
         return rv
@@ -90,6 +90,110 @@ class ExtendedAPITestCase(JinjaTestCase):
         t = env.from_string('{{ foo }}')
         assert t.render(foo='<foo>') == '<foo>'
 
+    def test_node_traversal(self):
+        from jinja2 import nodes
+        ast = env.parse('{{ a }}{% for b in c %}{{ d(e) }}{% endfor %}{{ f }}')
+        assert [x.name for x in ast.find_all(nodes.Name)] == \
+            ['a', 'b', 'c', 'd', 'e', 'f']
+        assert ast.find(nodes.Call).node.name == 'd'
+        loop = ast.find(nodes.For)
+        assert [x.name for x in loop.iter_child_nodes(only=('target',))] \
+            == ['b']
+        assert len(list(loop.iter_child_nodes(exclude=('body',)))) == 2
+        assert not hasattr(loop, '__dict__')
+
+    def test_node_visitor(self):
+        from jinja2 import nodes
+        from jinja2.visitor import NodeVisitor
+        class NameCollector(NodeVisitor):
+            def __init__(self):
+                self.names = []
+            def visit_Name(self, node):
+                self.names.append(node.name)
+            def visit_Call(self, node):
+                self.names.append('call')
+                self.generic_visit(node)
+        class RecursiveCollector(NameCollector):
+            def generic_visit(self, node):
+                NameCollector.generic_visit(self, node)
+        class CustomCollector(NameCollector):
+            def get_visitor(self, node):
+                if isinstance(node, nodes.Const):
+                    return lambda node: self.names.append(node.value)
+                return NameCollector.get_visitor(self, node)
+        ast = env.parse('{{ a }}{% for b in c %}{{ d(e, 1) }}{% endfor %}')
+        for cls in NameCollector, RecursiveCollector:
+            visitor = cls()
+            visitor.visit(ast)
+            assert visitor.names == ['a', 'b', 'c', 'call', 'd', 'e']
+        visitor = CustomCollector()
+        visitor.visit(ast)
+        assert visitor.names == ['a', 'b', 'c', 'call', 'd', 'e', 1]
+
+    def test_node_visitor_overrides(self):
+        from jinja2.visitor import NodeVisitor
+        class NodeCollector(NodeVisitor):
+            def __init__(self):
+                self.nodes = []
+            def visit(self, node):
+                self.nodes.append(node.__class__.__name__)
+                return NodeVisitor.visit(self, node)
+        class NameCollector(NodeVisitor):
+            def __init__(self):
+                self.names = []
+            def visit_Name(self, node):
+                self.names.append(node.name)
+        ast = env.parse('{{ a }}{{ b(1) }}')
+        visitor = NodeCollector()
+        visitor.visit(ast)
+        assert visitor.nodes == ['Template', 'Output', 'Name', 'Call',
+                                 'Name', 'Const']
+
+        visitor = NameCollector()
+        visitor.visit(ast)
+        visitor.visit_Const = lambda node: visitor.names.append(node.value)
+        visitor.visit(ast)
+        assert visitor.names == ['a', 'b', 'a', 'b', 1]
+
+        visitor = NameCollector()
+        NameCollector.visit_Name = lambda self, node: \
+            self.names.append(node.name.upper())
+        visitor.visit(ast)
+        del NameCollector.visit_Name
+        visitor.visit(ast)
+        assert visitor.names == ['A', 'B']
+
+    def test_spontaneous_environments(self):
+        from jinja2 import environment
+        environment.set_spontaneous_environment_cache_size(3)
+        try:
+            envs = []
+            for x in xrange(3):
+                tmpl = Template('{{ x }}', finalize=lambda x: x * 2)
+                assert tmpl.render(x=21) == '42'
+                envs.append(tmpl.environment)
+            Template('{{ x }}', extensions=['jinja2.ext.do'])
+            Template('{{ x }}', extensions=('jinja2.ext.do',))
+            assert envs[0] is envs[1] is envs[2]
+            assert environment.spontaneous_environment_cache_info() == \
+                (3, 2, 2, 3)
+
+            # functions with different state must not share environments
+            tmpls = [Template('{{ x }}', finalize=lambda x, y=y: y)
+                     for y in [1], [1]]
+            assert tmpls[0].environment is not tmpls[1].environment
+        finally:
+            environment.set_spontaneous_environment_cache_size(10)
+
+    def test_config_key(self):
+        from jinja2.environment import make_config_key
+        assert make_config_key([1, {'a': set([2])}]) == \
+            make_config_key([1, {'a': set([2])}])
+        assert make_config_key([1]) != make_config_key((1,))
+        class Unhashable(object):
+            __hash__ = None
+        self.assert_raises(TypeError, make_config_key, Unhashable())
+
 
 class MetaTestCase(JinjaTestCase):
 
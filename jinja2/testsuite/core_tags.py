@@ -13,11 +13,24 @@ import unittest
 from jinja2.testsuite import JinjaTestCase
 
 from jinja2 import Environment, TemplateSyntaxError, UndefinedError, \
-     DictLoader
+     DictLoader, nodes
+from jinja2.compiler import CodeGenerator
+from jinja2.optimizer import optimize
 
 env = Environment()
 
 
+def count_yields(source, **options):
+    """Count the output yields of the code generated for a template."""
+    environment = Environment(**options)
+    node = environment.parse(source)
+    if environment.optimized:
+        node = optimize(node, environment)
+    generator = CodeGenerator(environment, None, None)
+    generator.visit(node)
+    return generator.yield_count
+
+
 class ForLoopTestCase(JinjaTestCase):
 
     def test_simple(self):
@@ -167,6 +180,31 @@ class ForLoopTestCase(JinjaTestCase):
             '{{ a }}|{{ b }}|{{ c }}{% endfor %}')
         assert tmpl.render() == '1|2|3'
 
+    def test_nested_loop_analysis(self):
+        from jinja2.compiler import TreeAnalysis, find_undeclared
+        source = ('{% for a in x|sort %}{% for b in a if b is odd %}'
+                  '{{ loop.index }}{% set loop = 1 %}{% endfor %}'
+                  '{% block foo %}{{ loop|e }}{% endblock %}{% endfor %}')
+        ast = env.parse(source)
+        analysis = TreeAnalysis()
+        for node in [ast] + list(ast.find_all(nodes.Node)):
+            children = list(node.iter_child_nodes())
+            assert analysis.find_undeclared(children, ('loop',)) == \
+                find_undeclared(children, ('loop',))
+        outer = ast.find(nodes.For)
+        assert analysis.find_dependencies(outer.body) == \
+            (set(), set(['odd']))
+        assert analysis.find_dependencies([outer]) == \
+            (set(['sort']), set(['odd']))
+        assert analysis.find_loop_store(outer) == 1
+        self.assert_raises(TemplateSyntaxError, env.from_string, source)
+
+        # temporary nodes must not be mixed up even if their ids are reused
+        analysis = TreeAnalysis()
+        for name in ['loop', 'foo'] * 5:
+            access = analysis.get(nodes.Name(name, 'load'))[0]
+            assert (name in access) == (name == 'loop')
+
 
 class IfConditionTestCase(JinjaTestCase):
 
@@ -198,6 +236,26 @@ class IfConditionTestCase(JinjaTestCase):
         tmpl = env.from_string('{% if true %}{% set foo = 1 %}{% endif %}{{ foo }}')
         assert tmpl.render() == '1'
 
+    def test_static_data_hoisting(self):
+        source = ('<p>{% if a %}<b>{{ a }}</b>{% elif b %}<b>{{ b }}</b>'
+                  '{% else %}<b>-</b>{% endif %}</p>')
+        tmpl = env.from_string(source)
+        assert tmpl.render(a=1) == '<p><b>1</b></p>'
+        assert tmpl.render(b=2) == '<p><b>2</b></p>'
+        assert tmpl.render() == '<p><b>-</b></p>'
+        # once in the sink and once in the generator version of root
+        code = env.compile(source, raw=True)
+        assert code.count("'<p><b>'") == 2
+        assert code.count("'</b></p>'") == 2
+
+    def test_output_merging(self):
+        source = ('A{% if true %}B{% endif %}{% set foo = 42 %}C{{ foo }}'
+                  '{% if false %}X{% else %}D{% endif %}')
+        tmpl = env.from_string(source)
+        assert tmpl.render() == 'ABC42D'
+        assert count_yields(source) == 1
+        assert count_yields(source, optimized=False) == 6
+
 
 class MacrosTestCase(JinjaTestCase):
     env = Environment(trim_blocks=True)
@@ -53,6 +53,22 @@ ZeroDivisionError: (int(eger)? )?division (or modulo )?by zero
 (jinja2\.exceptions\.)?TemplateSyntaxError: wtf
   line 42''')
 
+    def test_local_extraction(self):
+        from jinja2.debug import TemplateFrameLocals
+        tmpl = env.from_string('{% set foo = 42 %}{{ bar.baz() }}')
+        try:
+            tmpl.render(bar=None)
+        except Exception:
+            tb = sys.exc_info()[2]
+        while tb.tb_next is not None:
+            tb = tb.tb_next
+        locals = tb.tb_frame.f_locals
+        assert isinstance(locals, TemplateFrameLocals)
+        assert locals._locals is None
+        assert locals['foo'] == 42
+        assert 'bar' in locals
+        assert '__jinja_exception__' not in locals
+
 
 def suite():
     suite = unittest.TestSuite()
@@ -99,6 +99,20 @@ i18n_env.globals.update({
     'ngettext':     ngettext
 })
 
+def make_catalog_translations(language):
+    from gettext import GNUTranslations
+    translations = GNUTranslations()
+    translations._catalog = catalog = {}
+    for key, value in languages[language].iteritems():
+        catalog[key] = value
+    catalog['One user online', 0] = catalog.pop('One user online')
+    catalog['One user online', 1] = catalog.pop('%(user_count)s users online')
+    catalog['%(num)s apple', 0] = catalog.pop('%(num)s apple')
+    catalog['%(num)s apple', 1] = catalog.pop('%(num)s apples')
+    translations.plural = lambda n: int(n != 1)
+    return translations
+
+
 newstyle_i18n_env = Environment(
     loader=DictLoader(newstyle_i18n_templates),
     extensions=['jinja2.ext.i18n']
@@ -298,6 +312,135 @@ class InternationalizationTestCase(JinjaTestCase):
             (6, 'ngettext', (u'%(users)s user', u'%(users)s users', None), ['third'])
         ]
 
+    def test_extract_from_environment(self):
+        from jinja2.ext import extract_from_environment
+        loader = DictLoader({
+            'a.html': '{# trans hello #}{{ _("Hello") }}\n'
+                      '{% trans %}{{ users }} user{% pluralize %}'
+                      '{{ users }} users{% endtrans %}',
+            'b.html': '{% trans %}Bye{% endtrans %}',
+            'broken.html': '{% trans %}',
+            'notes.txt': '{{ _("Skipped") }}'
+        })
+        env = Environment(loader=loader, extensions=['jinja2.ext.i18n'])
+        expected = [
+            ('a.html', 1, '_', u'Hello', ['hello']),
+            ('a.html', 2, 'ngettext', (u'%(users)s user',
+                                       u'%(users)s users', None), []),
+            ('b.html', 1, 'gettext', u'Bye', [])
+        ]
+        cache = {}
+        for processes in 1, 2:
+            rv = extract_from_environment(env, comment_tags=['trans'],
+                                          extensions=['html'],
+                                          processes=processes)
+            assert list(rv) == expected
+        rv = extract_from_environment(env, comment_tags=['trans'],
+                                      extensions=['html'], cache=cache)
+        assert list(rv) == expected
+        assert len(cache) == 3
+
+        loader.mapping['b.html'] = '{% trans %}Bye!{% endtrans %}'
+        del loader.mapping['broken.html']
+        rv = extract_from_environment(env, comment_tags=['trans'],
+                                      extensions=['html'], cache=cache,
+                                      processes=1)
+        assert list(rv)[-1] == ('b.html', 1, 'gettext', u'Bye!', [])
+        assert len(cache) == 4
+
+
+class CompiledInternationalizationTestCase(JinjaTestCase):
+
+    def setup(self):
+        self.translations = make_catalog_translations('de')
+        self.env = Environment(loader=DictLoader(newstyle_i18n_templates),
+                               extensions=['jinja2.ext.i18n'])
+        self.env.install_null_translations()
+
+    def test_translated_environment(self):
+        env = self.env.get_translated_environment('de', self.translations)
+        assert env is self.env.get_translated_environment('de',
+                                                          self.translations)
+        assert env.bytecode_cache is None
+        assert self.env.compiled_translations is None
+        tmpl = env.get_template('child.html')
+        assert tmpl.render() == '<title>fehlend</title>pass auf'
+        assert self.env.get_template('child.html').render() == \
+            '<title>missing</title>watch out'
+        assert 'pass auf' in env.compile('{% trans %}watch out{% endtrans %}',
+                                         raw=True)
+
+    def test_translated_overlay(self):
+        overlay = self.env.overlay(loader=DictLoader({
+            'child.html': '{% trans %}watch out{% endtrans %} tenant A'}))
+        overlay.globals = self.env.globals.copy()
+        overlay.install_gettext_translations(self.translations)
+        assert 'ngettext' in overlay.globals
+        assert self.env.globals['gettext']('watch out') == 'watch out'
+        env = overlay.get_translated_environment('de', self.translations)
+        assert env.get_template('child.html').render() == \
+            'pass auf tenant A'
+        assert overlay.translated_environments == {'de': env}
+        assert self.env.translated_environments == {}
+
+    def test_trans_plural(self):
+        env = self.env.get_translated_environment('de', self.translations)
+        tmpl = env.get_template('plural.html')
+        assert tmpl.render(user_count=1) == 'Ein Benutzer online'
+        assert tmpl.render(user_count=2) == '2 Benutzer online'
+        tmpl = env.from_string('{% trans count=n %}{{ count }} item{% '
+                               'pluralize %}{{ count }} items{% endtrans %}')
+        assert tmpl.render(n=1) == '1 item'
+        assert tmpl.render(n=3) == '3 items'
+
+    def test_newstyle(self):
+        self.env.newstyle_gettext = True
+        env = self.env.get_translated_environment('de', self.translations)
+        tmpl = env.get_template('ngettext_long.html')
+        assert tmpl.render(apples=1) == '1 Apfel'
+        assert tmpl.render(apples=5) == u'5 Äpfel'
+        assert env.get_template('transvars1.html').render(num=1) == \
+            'Benutzer: 1'
+        assert env.get_template('novars.html').render() == '%(hello)s'
+        tmpl = env.from_string('{% trans n %}{{ n }} apple{% pluralize %}'
+                               '{{ n }} apples{% endtrans %}')
+        assert tmpl.render(n=2) == '2 apples'
+
+    def test_missing_plural_forms(self):
+        self.translations.plural = lambda n: n
+        env = self.env.get_translated_environment('de', self.translations)
+        tmpl = env.get_template('plural.html')
+        assert tmpl.render(user_count=1) == '1 Benutzer online'
+        assert tmpl.render(user_count=5) == '5 users online'
+        self.env.newstyle_gettext = True
+        env = self.env.get_translated_environment('fr', self.translations)
+        tmpl = env.get_template('ngettext_long.html')
+        assert tmpl.render(apples=5) == '5 apples'
+
+    def test_newstyle_num_evaluated_once(self):
+        self.env.newstyle_gettext = True
+        env = self.env.get_translated_environment('de', self.translations)
+        calls = []
+        def count(n):
+            calls.append(n)
+            return n
+        tmpl = env.from_string('{% trans num=count(n) %}{{ num }} apple'
+                               '{% pluralize %}{{ num }} apples{% endtrans %}')
+        assert tmpl.render(n=5, count=count) == u'5 \xc4pfel'
+        assert calls == [5]
+        del calls[:]
+        tmpl = env.from_string('{% trans x=count(n) %}{{ x }} pear'
+                               '{% pluralize %}{{ x }} pears{% endtrans %}')
+        assert tmpl.render(n=1, count=count) == '1 pear'
+        assert calls == [1]
+
+    def test_runtime_fallback(self):
+        from gettext import NullTranslations
+        env = self.env.get_translated_environment('en', NullTranslations())
+        tmpl = env.get_template('plural.html')
+        assert tmpl.render(user_count=1) == 'One user online'
+        assert tmpl.render(user_count=2) == '2 users online'
+
 
 class NewstyleInternationalizationTestCase(JinjaTestCase):
 
@@ -336,6 +479,38 @@ class NewstyleInternationalizationTestCase(JinjaTestCase):
         assert t.render(ae=True) == '<strong>Wert: &lt;test&gt;</strong>'
         assert t.render(ae=False) == '<strong>Wert: <test></strong>'
 
+    def test_memoized_translations(self):
+        translations = make_catalog_translations('de')
+        calls = []
+        def ugettext(message):
+            calls.append(message)
+            return translations.__class__.ugettext(translations, message)
+        def ungettext(singular, plural, n):
+            calls.append(singular)
+            return translations.__class__.ungettext(translations, singular,
+                                                        plural, n)
+        translations.ugettext = ugettext
+        translations.ungettext = ungettext
+        env = Environment(loader=DictLoader(newstyle_i18n_templates),
+                          extensions=['jinja2.ext.i18n'])
+        env.install_gettext_translations(translations, newstyle=True)
+        tmpl = env.get_template('ngettext_long.html')
+        for x in xrange(3):
+            assert tmpl.render(apples=1) == '1 Apfel'
+            assert tmpl.render(apples=5) == u'5 Äpfel'
+            assert tmpl.render(apples=6) == u'6 Äpfel'
+            assert env.get_template('child.html').render() == \
+                '<title>fehlend</title>pass auf'
+        assert sorted(calls) == ['%(num)s apple', '%(num)s apple',
+                                 'missing', 'watch out']
+
+        env.gettext_cache_size = 0
+        env.install_gettext_translations(translations, newstyle=True)
+        del calls[:]
+        env.get_template('child.html').render()
+        env.get_template('child.html').render()
+        assert len(calls) == 4
+
     def test_num_used_twice(self):
         tmpl = newstyle_i18n_env.get_template('ngettext_long.html')
         assert tmpl.render(apples=5, LANGUAGE='de') == u'5 Äpfel'
@@ -450,6 +625,7 @@ def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(ExtensionsTestCase))
     suite.addTest(unittest.makeSuite(InternationalizationTestCase))
+    suite.addTest(unittest.makeSuite(CompiledInternationalizationTestCase))
     suite.addTest(unittest.makeSuite(NewstyleInternationalizationTestCase))
     suite.addTest(unittest.makeSuite(AutoEscapeTestCase))
     return suite
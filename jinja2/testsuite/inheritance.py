@@ -8,6 +8,7 @@
     :copyright: (c) 2010 by the Jinja Team.
     :license: BSD, see LICENSE for more details.
 """
+import sys
 import unittest
 
 from jinja2.testsuite import JinjaTestCase
@@ -182,6 +183,56 @@ class InheritanceTestCase(JinjaTestCase):
         rv = env.get_template('index.html').render(the_foo=42).split()
         assert rv == ['43', '44', '45']
 
+    def test_delegation(self):
+        from jinja2.compiler import have_yield_from
+        code = env.compile(LEVEL1TEMPLATE, raw=True)
+        assert ('yield from parent_template.' in code) == have_yield_from
+        assert ('for event in parent_template.' in code) != have_yield_from
+        code = env.compile('{% block x %}{% endblock %}'
+                           '{% include "layout" %}', raw=True)
+        assert code.count('yield from ') == (have_yield_from and 2 or 0)
+        stream = env.get_template('level4').stream()
+        assert stream.next() == '|'
+
+    def test_buffered_delegation(self):
+        source = ('{% macro m() %}{% block b %}[{% endblock %}'
+                  '{% include "layout" %}{% endmacro %}{{ m() }}')
+        code = env.compile(source, raw=True)
+        assert code.count('render_into(') == 4
+        assert 'for event in' not in code
+        assert env.from_string(source).render() == \
+            '[|block 1 from layout|block 2 from layout|' \
+            'nested block 4 from layout|'
+
+    def test_render_sink(self):
+        env = Environment(loader=DictLoader({
+            'layout':       LAYOUTTEMPLATE,
+            'level1':       LEVEL1TEMPLATE,
+            'index':        '{% extends "level1" %}{% block block2 %}'
+                            '{% include "layout" %}{% block inner %}'
+                            '{% include "layout" without context %}'
+                            '{% endblock %}{% endblock %}'
+        }))
+        yields = []
+        def trace(frame, event, arg):
+            if event == 'return' and frame.f_code.co_flags & 0x20 and \
+               '__jinja_template__' in frame.f_globals:
+                yields.append(frame.f_code.co_name)
+            return trace
+        tmpl = env.get_template('index')
+        old_trace = sys.gettrace()
+        sys.settrace(trace)
+        try:
+            rendered = tmpl.render()
+            rendered_yields = len(yields)
+            streamed = u''.join(tmpl.generate())
+        finally:
+            sys.settrace(old_trace)
+        assert rendered == streamed
+        assert rendered.count('block 1 from layout') == 2
+        assert rendered_yields == 0
+        assert len(yields) > 0
+
 
 class BugFixTestCase(JinjaTestCase):
 
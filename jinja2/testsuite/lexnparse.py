@@ -29,6 +29,24 @@ else:
 
 class LexerTestCase(JinjaTestCase):
 
+    def test_lexer_caches(self):
+        from jinja2 import lexer, clear_caches
+        syntax = dict(block_start_string='<%', block_end_string='%>',
+                      variable_start_string='${', variable_end_string='}')
+        env1 = Environment(**syntax)
+        env2 = Environment(newline_sequence='\r\n', **syntax)
+        assert env1.lexer is not env2.lexer
+        assert env1.lexer.rules is env2.lexer.rules
+        tmpl = env2.from_string('<% for x in seq %>${ x }\n<% endfor %>')
+        assert tmpl.render(seq=[1, 2]) == '1\r\n2\r\n'
+
+        pinned = lexer.preload_lexer(env1)
+        assert lexer.preload_lexer(env1) is pinned
+        clear_caches()
+        assert Environment(**syntax).lexer is pinned
+        assert env2.lexer is not pinned
+        lexer._pinned_lexers.clear()
+
     def test_raw1(self):
         tmpl = env.from_string('{% raw %}foo{% endraw %}|'
                                '{%raw%}{{ bar }}|{% baz %}{%       endraw    %}')
@@ -82,6 +100,58 @@ class LexerTestCase(JinjaTestCase):
             result = tmpl.render()
             assert result.replace(seq, 'X') == '1X2X3X4'
 
+    def test_minify_whitespace(self):
+        env = Environment(minify_whitespace=True)
+        tmpl = env.from_string('<ul>\n    <li>  {{ foo }}  </li>\n\n</ul>  ')
+        assert tmpl.render(foo='a  b') == '<ul>\n<li> a  b </li>\n</ul> '
+        tmpl = env.from_string('<p>  x  </p><pre class="{{ c }}">  a\n\n'
+                               '  {{ c }}  </pre>  <textarea> b  </textarea>'
+                               '<script>  1;\n\n</script>  {% raw %}  c  '
+                               '{% endraw %}  ')
+        assert tmpl.render(c='d') == ('<p> x </p><pre class="d">  a\n\n  d'
+                                      '  </pre> <textarea> b  </textarea>'
+                                      '<script>  1;\n\n</script>   c   ')
+        assert Environment().from_string('  a  ').render() == '  a  '
+        tmpl = env.from_string('<pre-line>  a  </pre-line>')
+        assert tmpl.render() == '<pre-line> a </pre-line>'
+
+    def test_minify_whitespace_trans(self):
+        from jinja2.ext import babel_extract
+        from StringIO import StringIO
+        source = ('<p>  {% trans %}Hello   big\n   world{% endtrans %}  '
+                  '</p>')
+        env = Environment(minify_whitespace=True,
+                          extensions=['jinja2.ext.i18n'])
+        env.install_gettext_callables(lambda x: '[%s]' % x,
+                                      lambda s, p, n: s)
+        msgid = list(babel_extract(StringIO(source), ('gettext',), [],
+                                   {}))[0][2]
+        assert msgid == u'Hello   big\n   world'
+        assert env.from_string(source).render() == \
+            u'<p> [Hello   big\n   world] </p>'
+        env = Environment(minify_whitespace=True, line_statement_prefix='#',
+                          extensions=['jinja2.ext.i18n'])
+        env.install_gettext_callables(lambda x: '[%s]' % x,
+                                      lambda s, p, n: s)
+        tmpl = env.from_string('<p>  \n# trans\nHello   world\n# endtrans\n'
+                               '  </p>')
+        assert tmpl.render() == u'<p>\n[Hello   world\n] </p>'
+
+    def test_minify_whitespace_verbatim_tags(self):
+        from jinja2.ext import Extension
+        class CodeExtension(Extension):
+            tags = set(['code'])
+            verbatim_tags = set(['code'])
+            def parse(self, parser):
+                lineno = parser.stream.next().lineno
+                body = parser.parse_statements(['name:endcode'],
+                                               drop_needle=True)
+                return nodes.Scope(body, lineno=lineno)
+        source = '<p>  {% code %}a   b{% endcode %}  c   d</p>'
+        env = Environment(minify_whitespace=True)
+        env.add_extension(CodeExtension)
+        assert env.from_string(source).render() == '<p> a   b c d</p>'
+
 
 class ParserTestCase(JinjaTestCase):
 
@@ -193,6 +263,37 @@ and bar comment #}
         assert_error('{% unknown_tag %}',
                      "Encountered unknown tag 'unknown_tag'.")
 
+    def test_reuse_subtrees(self):
+        from jinja2.parser import Parser
+        source = (u'{% macro m() %}M{% endmacro %}\n'
+                  u'{% block a %}{{ a }}{% endblock %}\n'
+                  u'{% block b %}{% block c %}C{% endblock %}{% endblock %}')
+        parser = Parser(env, source, subtrees={})
+        macro, block_a, block_b = parser.parse().body[::2]
+        assert len(parser.subtrees) == 3
+
+        parser = Parser(env, source, subtrees=parser.subtrees)
+        body = parser.parse().body
+        assert [x.node for x in body if isinstance(x, nodes.Optimized)] == \
+            [macro, block_a, block_b]
+        assert body[0].node is macro
+
+        parser = Parser(env, u'x\n' + source.replace('a }}', 'a|e }}'),
+                        subtrees=parser.subtrees)
+        body = parser.parse().body
+        assert isinstance(body[1], nodes.Optimized)
+        assert body[1].node.lineno == 2
+        assert body[3].lineno == 3
+        assert body[3].find(nodes.Filter) is not None
+        assert isinstance(body[5], nodes.Optimized)
+        assert body[5].node.find(nodes.Block).lineno == 4
+        assert block_b.find(nodes.Block).lineno == 3
+        assert len(parser.subtrees) == 3
+
+        self.assert_raises(TemplateSyntaxError, Parser(
+            env, u'{% block a %}{% block b %}{% endblock %}',
+            subtrees=parser.subtrees).parse)
+
 
 class SyntaxTestCase(JinjaTestCase):
 
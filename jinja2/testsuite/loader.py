@@ -18,7 +18,7 @@ from jinja2.testsuite import JinjaTestCase, dict_loader, \
      package_loader, filesystem_loader, function_loader, \
      choice_loader, prefix_loader
 
-from jinja2 import Environment, loaders
+from jinja2 import Environment, loaders, clear_caches
 from jinja2.loaders import split_template_path
 from jinja2.exceptions import TemplateNotFound
 
@@ -31,12 +31,84 @@ class LoaderTestCase(JinjaTestCase):
         assert tmpl.render().strip() == 'FOO'
         self.assert_raises(TemplateNotFound, env.get_template, 'missing.html')
 
+    def test_freeze(self):
+        from jinja2.exceptions import TemplateSyntaxError
+        loader = loaders.DictLoader({
+            'a.html': 'A',
+            'b.html': '{% include "a.html" %}B',
+            'broken.html': '{% if %}'
+        })
+        env = Environment(loader=loader, cache_size=1, auto_reload=True)
+        env.freeze()
+        assert env.shared
+        assert not env.auto_reload
+        assert sorted(env.cache.keys()) == ['a.html', 'b.html']
+        loader.mapping['a.html'] = 'changed'
+        assert env.get_template('b.html').render() == 'AB'
+
+        env = Environment(loader=loader, cache_size=0)
+        env.freeze(extensions=['html'])
+        assert len(env.cache) == 2
+        env = Environment(loader=loader)
+        self.assert_raises(TemplateSyntaxError, env.freeze,
+                           ignore_errors=False)
+
+    def test_freeze_globals(self):
+        env = Environment(loader=loaders.DictLoader({
+            'a.html': '{{ range(3)|list }}{{ foo }}'
+        }))
+        env.globals['foo'] = 42
+        env.freeze()
+        assert env.get_template('a.html').render() == '[0, 1, 2]42'
+
+    def test_freeze_skips_binary_files(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            f = open(os.path.join(tmpdir, 'a.html'), 'w')
+            f.write('A')
+            f.close()
+            f = open(os.path.join(tmpdir, 'image.png'), 'wb')
+            f.write(u'\x89PNG\xff'.encode('latin-1'))
+            f.close()
+            env = Environment(loader=loaders.FileSystemLoader(tmpdir))
+            env.freeze()
+            assert env.cache.keys() == ['a.html']
+            env = Environment(loader=loaders.FileSystemLoader(tmpdir))
+            self.assert_raises(UnicodeDecodeError, env.freeze,
+                               ignore_errors=False)
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_package_loader(self):
         env = Environment(loader=package_loader)
         tmpl = env.get_template('test.html')
         assert tmpl.render().strip() == 'BAR'
+        assert 'foo/test.html' in env.list_templates()
         self.assert_raises(TemplateNotFound, env.get_template, 'missing.html')
 
+    def test_package_loader_zip(self):
+        from zipfile import ZipFile
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, 'package.zip')
+        zip_file = ZipFile(filename, 'w')
+        zip_file.writestr('zippedpackage/__init__.py', '')
+        zip_file.writestr('zippedpackage/templates/test.html', 'ZIP')
+        zip_file.writestr('zippedpackage/templates/foo/bar.html', 'BAR')
+        zip_file.close()
+        sys.path.insert(0, filename)
+        try:
+            loader = loaders.PackageLoader('zippedpackage')
+            assert loader.provider is None
+            env = Environment(loader=loader)
+            assert env.get_template('test.html').render() == 'ZIP'
+            assert env.list_templates() == ['foo/bar.html', 'test.html']
+            self.assert_raises(TemplateNotFound, env.get_template,
+                               'missing.html')
+        finally:
+            sys.path.remove(filename)
+            sys.modules.pop('zippedpackage', None)
+            shutil.rmtree(tmpdir)
+
     def test_filesystem_loader(self):
         env = Environment(loader=filesystem_loader)
         tmpl = env.get_template('test.html')
@@ -45,6 +117,41 @@ class LoaderTestCase(JinjaTestCase):
         assert tmpl.render().strip() == 'FOO'
         self.assert_raises(TemplateNotFound, env.get_template, 'missing.html')
 
+    def test_filesystem_loader_index(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for name, source in (('a/test.html', 'A'), ('a/only.html', 'O'),
+                                 ('b/test.html', 'B'), ('b/sub/x.html', 'X')):
+                dirname = os.path.dirname(os.path.join(tmpdir, name))
+                if not os.path.isdir(dirname):
+                    os.makedirs(dirname)
+                f = open(os.path.join(tmpdir, name), 'w')
+                f.write(source)
+                f.close()
+            searchpath = [os.path.join(tmpdir, 'a'), os.path.join(tmpdir, 'b')]
+            loader = loaders.FileSystemLoader(searchpath, use_index=True)
+            env = Environment(loader=loader)
+            assert env.get_template('test.html').render() == 'A'
+            assert env.get_template('./sub/x.html').render() == 'X'
+            assert env.list_templates() == ['only.html', 'sub/x.html',
+                                            'test.html']
+            f = open(os.path.join(tmpdir, 'b', 'new.html'), 'w')
+            f.write('N')
+            f.close()
+            self.assert_raises(TemplateNotFound, env.get_template, 'new.html')
+            loader.refresh_index()
+            assert env.get_template('new.html').render() == 'N'
+            os.remove(os.path.join(tmpdir, 'a', 'only.html'))
+            self.assert_raises(TemplateNotFound, loader.get_source, env,
+                               'only.html')
+            loader = loaders.FileSystemLoader(searchpath, use_index=True,
+                                              index_ttl=-1)
+            assert 'only.html' not in loader.list_templates()
+            assert loader.list_templates() == \
+                loaders.FileSystemLoader(searchpath).list_templates()
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_choice_loader(self):
         env = Environment(loader=choice_loader)
         tmpl = env.get_template('justdict.html')
@@ -93,6 +200,140 @@ class LoaderTestCase(JinjaTestCase):
         assert 'two' not in env.cache
         assert 'three' in env.cache
 
+    def test_reload_unchanged_source(self):
+        sources = {'template': u'foo'}
+        class TestLoader(loaders.BaseLoader):
+            def get_source(self, environment, template):
+                return sources[template], None, lambda: False
+        class CountingEnvironment(Environment):
+            compiled = 0
+            def compile(self, *args, **kwargs):
+                self.compiled += 1
+                return Environment.compile(self, *args, **kwargs)
+        env = CountingEnvironment(loader=TestLoader())
+        tmpl = env.get_template('template')
+        assert tmpl is not env.get_template('template')
+        assert env.compiled == 1
+        sources['template'] = u'bar'
+        assert env.get_template('template').render() == 'bar'
+        assert env.compiled == 2
+
+        env = CountingEnvironment(loader=TestLoader(), auto_reload=False)
+        env.get_template('template')
+        env.cache.clear()
+        env.get_template('template')
+        # the code of the first environment is reused
+        assert env.compiled == 0
+
+        clear_caches()
+        env.cache.clear()
+        env.get_template('template')
+        env.cache.clear()
+        env.get_template('template')
+        assert env.compiled == 1
+
+        env = CountingEnvironment(loader=TestLoader(), code_cache_size=0)
+        env.get_template('template')
+        assert env.compiled == 1
+        env = CountingEnvironment(loader=TestLoader(), cache_size=0)
+        env.get_template('template')
+        assert env.compiled == 0
+        env = CountingEnvironment(loader=TestLoader(), code_cache_size=10)
+        assert env.code_cache is not Environment().code_cache
+        assert env.code_cache is env.overlay().code_cache
+        assert env.overlay(code_cache_size=0).code_cache is None
+        env.get_template('template')
+        assert env.compiled == 1
+
+    def test_reload_edited_source(self):
+        source = u'{% block a %}A{% endblock %}\n{% block b %}{{ b }}' \
+                 u'{% endblock %}'
+        sources = {}
+        class TestLoader(loaders.BaseLoader):
+            def get_source(self, environment, template):
+                return sources[template], None, lambda: False
+        env = Environment(loader=TestLoader())
+        for prefix in u'', u'1', u'2\n\n':
+            sources['template'] = prefix + source
+            tmpl = env.get_template('template')
+            assert tmpl.render(b='B') == prefix + 'A\nB'
+        # the unchanged block moved down by two lines
+        assert max(x for x, y in tmpl.debug_info) == 4
+        assert 'b' in tmpl.blocks
+
+    def test_code_cache_filters(self):
+        loader = loaders.DictLoader({'a': u'{{ "x"|shout }}'})
+        env = Environment(loader=loader)
+        env.filters['shout'] = lambda s: s.upper()
+        other = Environment(loader=loader)
+        other.filters['shout'] = lambda s: s + '!'
+        assert env.get_template('a').render() == 'X'
+        assert other.get_template('a').render() == 'x!'
+        key = env._get_compile_key()
+        assert env._get_compile_key() is key
+        env.cache.clear()
+        env.filters['shout'] = lambda s: s + '?'
+        assert env.get_template('a').render() == 'x?'
+        env.cache.clear()
+        env.tests['loud'] = lambda s: s.isupper()
+        assert env._get_compile_key() != key
+        env.autoescape = True
+        assert env._get_compile_key() != key
+
+    def test_overlay_code_sharing(self):
+        class CountingEnvironment(Environment):
+            compiled = 0
+            def compile(self, *args, **kwargs):
+                CountingEnvironment.compiled += 1
+                return Environment.compile(self, *args, **kwargs)
+        loader = loaders.DictLoader({'a': u'{{ "<" }}'})
+        env = CountingEnvironment(loader=loader)
+        overlay = env.overlay()
+        assert env.get_template('a').render() == '<'
+        assert overlay.get_template('a').render() == '<'
+        assert overlay.get_template('a').environment is overlay
+        assert CountingEnvironment.compiled == 1
+        autoescaped = env.overlay(autoescape=True)
+        assert autoescaped.get_template('a').render() == '&lt;'
+        assert CountingEnvironment.compiled == 2
+        other = CountingEnvironment(loader=loader)
+        assert other.get_template('a').render() == '<'
+        other = CountingEnvironment(loader=loader,
+                                    extensions=['jinja2.ext.do'])
+        assert other.get_template('a').render() == '<'
+        assert CountingEnvironment.compiled == 3
+
+    def test_overlay_filters(self):
+        loader = loaders.DictLoader({'a': u'{{ "x"|shout }}'})
+        env = Environment(loader=loader)
+        env.filters['shout'] = lambda s: s.upper()
+        overlay = env.overlay()
+        env.filters['whisper'] = lambda s: s.lower()
+        assert overlay.filters['whisper']('X') == 'x'
+        overlay.filters = dict(env.filters, shout=lambda s: s + '!')
+        overlay.globals = dict(env.globals, tenant='A')
+        assert env.get_template('a').render() == 'X'
+        assert overlay.get_template('a').render() == 'x!'
+        assert env.filters['shout']('x') == 'X'
+        assert 'tenant' not in env.globals
+
+    def test_overlay_pool(self):
+        from jinja2 import OverlayPool
+        env = Environment(loader=loaders.DictLoader({'a': u'{{ x }}'}))
+        def factory(environment, tenant):
+            rv = environment.overlay()
+            rv.globals = dict(environment.globals, x=tenant)
+            return rv
+        pool = OverlayPool(env, factory, size=2, max_idle=60)
+        assert pool.get('foo').get_template('a').render() == 'foo'
+        assert pool.get('foo') is pool.get('foo')
+        assert pool.get('bar').get_template('a').render() == 'bar'
+        pool.get('baz')
+        assert len(pool) == 2 and 'foo' not in pool
+        pool._overlays['bar'][1] -= 120
+        pool.evict_idle()
+        assert 'bar' not in pool and 'baz' in pool
+
     def test_split_template_path(self):
         assert split_template_path('foo/bar') == ['foo', 'bar']
         assert split_template_path('./foo/bar') == ['foo', 'bar']
@@ -182,6 +423,25 @@ class ModuleLoaderTestCase(JinjaTestCase):
             tmpl_3c4ddf650c1a73df961a6d3d2ce2752f1b8fd490
         assert mod.__file__.endswith('.pyc')
 
+    def _test_preload(self):
+        loader = loaders.ModuleLoader(self.archive, preload=True)
+        assert 'a/test.html' in loader.list_templates()
+        assert 'a/syntaxerror.html' not in loader.list_templates()
+        self.mod_env = Environment(loader=loader)
+        self._test_common()
+        key = loaders.ModuleLoader.get_template_key('a/test.html')
+        assert '%s.%s' % (loader.package_name, key) not in sys.modules
+        self.assert_raises(TemplateNotFound,
+                           self.mod_env.get_template, 'missing.html')
+
+    def test_zip_preload(self):
+        self.compile_down()
+        self._test_preload()
+
+    def test_filesystem_preload(self):
+        self.compile_down(zip=None)
+        self._test_preload()
+
     def test_choice_loader(self):
         log = self.compile_down(py_compile=True)
         assert 'Byte-compiled "a/test.html"' in log
@@ -211,8 +471,338 @@ class ModuleLoaderTestCase(JinjaTestCase):
         self.assert_equal(tmpl2.render(), 'DICT_TEMPLATE')
 
 
+stress_templates = dict(('t%d.html' % x, '{%% for x in seq %%}{{ x }}%d'
+                                       '{%% endfor %%}' % x)
+                        for x in range(20))
+
+
+def _bytecode_cache_worker(args):
+    from jinja2.bccache import FileSystemBytecodeCache
+    directory, names = args
+    compiled = []
+    class CountingEnvironment(Environment):
+        def compile(self, *args, **kwargs):
+            compiled.append(args)
+            return Environment.compile(self, *args, **kwargs)
+    clear_caches()
+    env = CountingEnvironment(loader=loaders.DictLoader(stress_templates),
+                              bytecode_cache=FileSystemBytecodeCache(
+                                  directory, lock=True))
+    for name in names:
+        assert env.get_template(name).render(seq=[1]) == '1' + name[1:-5]
+    return len(compiled)
+
+
+class FakeMemcache(object):
+
+    def __init__(self):
+        self.data = {}
+        self.calls = []
+
+    def get(self, key):
+        self.calls.append('get')
+        return self.data.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.calls.append('set')
+        self.data[key] = value
+
+    def get_multi(self, keys):
+        self.calls.append('get_multi')
+        return dict((x, self.data[x]) for x in keys if x in self.data)
+
+    def set_multi(self, mapping, timeout=None):
+        self.calls.append('set_multi')
+        self.data.update(mapping)
+
+
+class BytecodeCacheTestCase(JinjaTestCase):
+
+    def test_environment_fingerprint(self):
+        from jinja2.bccache import BytecodeCache
+        fingerprint = BytecodeCache().get_environment_fingerprint
+        a = Environment(finalize=lambda x: x)
+        b = Environment(finalize=lambda x: x)
+        assert fingerprint(a) == fingerprint(b)
+        assert fingerprint(a) != fingerprint(Environment())
+        assert fingerprint(Environment(block_start_string='<%')) != \
+               fingerprint(Environment())
+        assert fingerprint(Environment(extensions=['jinja2.ext.i18n'])) != \
+               fingerprint(Environment())
+        assert fingerprint(Environment(finalize=lambda x: x or '')) != \
+               fingerprint(a)
+        a.filters['shout'] = lambda s: s.upper()
+        b.filters['shout'] = lambda s: s + '!'
+        assert fingerprint(a) != fingerprint(b)
+
+        # closures and methods over different objects of the same class
+        class Suffix(object):
+            def __init__(self, value):
+                self.value = value
+            def __repr__(self):
+                return 'Suffix(%r)' % self.value
+            def add(self, s):
+                return s + self.value
+        def make_filter(suffix):
+            return lambda s: suffix.add(s)
+        def env_with_filter(f):
+            rv = Environment()
+            rv.filters['suffix'] = f
+            return fingerprint(rv)
+        assert env_with_filter(make_filter(Suffix('!'))) == \
+               env_with_filter(make_filter(Suffix('!')))
+        assert env_with_filter(make_filter(Suffix('!'))) != \
+               env_with_filter(make_filter(Suffix('?')))
+        assert env_with_filter(Suffix('!').add) != \
+               env_with_filter(Suffix('?').add)
+        opaque = object(), object()
+        assert env_with_filter(make_filter(opaque[0])) != \
+               env_with_filter(make_filter(opaque[1]))
+
+    def test_stale_finalize(self):
+        from jinja2.bccache import FileSystemBytecodeCache
+        loader = loaders.DictLoader({'a': u'{{ None }}'})
+        directory = tempfile.mkdtemp()
+        try:
+            for finalize, expected in [(lambda x: x, 'None'),
+                                       (lambda x: x or '', '')]:
+                clear_caches()
+                env = Environment(loader=loader, finalize=finalize,
+                                  bytecode_cache=FileSystemBytecodeCache(
+                                      directory))
+                assert env.get_template('a').render() == expected
+        finally:
+            shutil.rmtree(directory)
+
+    def test_memcached_multi(self):
+        from jinja2.bccache import MemcachedBytecodeCache
+        client = FakeMemcache()
+        loader = loaders.DictLoader({
+            'a.html': '{% include "b.html" %}A',
+            'b.html': 'B'
+        })
+        def make_env(**options):
+            clear_caches()
+            return Environment(loader=loader, auto_reload=False,
+                               bytecode_cache=MemcachedBytecodeCache(client),
+                               **options)
+
+        templates = make_env().get_templates(['a.html', 'b.html'])
+        assert [x.render() for x in templates] == ['BA', 'B']
+        assert client.calls == ['get_multi', 'set_multi']
+        assert len(client.data) == 2
+
+        del client.calls[:]
+        env = make_env()
+        templates = env.get_templates(['a.html', 'b.html'])
+        assert client.calls == ['get_multi']
+        assert env.get_template('a.html') is templates[0]
+        assert templates[0].render() == 'BA'
+        assert client.calls == ['get_multi']
+
+        # other options never reuse the code compiled for the first ones
+        del client.calls[:]
+        env = make_env(variable_start_string='${', variable_end_string='}')
+        assert env.get_template('b.html').render() == 'B'
+        assert client.calls == ['get', 'set']
+        assert len(client.data) == 3
+
+    def test_compression(self):
+        from jinja2.bccache import MemcachedBytecodeCache, \
+             FileSystemBytecodeCache
+        loader = loaders.DictLoader({'a.html': '{% for x in seq %}'
+                                     '<li>{{ x|e }}</li>{% endfor %}' * 20})
+        def load(bcc):
+            clear_caches()
+            env = Environment(loader=loader, bytecode_cache=bcc)
+            return env.get_template('a.html').render(seq=[1])
+
+        plain = FakeMemcache()
+        compressed = FakeMemcache()
+        load(MemcachedBytecodeCache(plain))
+        expected = load(MemcachedBytecodeCache(compressed,
+                                               compression='zlib'))
+        size = len(compressed.data.values()[0])
+        assert size < len(plain.data.values()[0]) / 2
+
+        # compressed buckets are loaded by caches that don't compress
+        del compressed.calls[:]
+        assert load(MemcachedBytecodeCache(compressed)) == expected
+        assert compressed.calls == ['get']
+        assert len(compressed.data.values()[0]) == size
+
+        # corrupted data is compiled again
+        key = compressed.data.keys()[0]
+        compressed.data[key] = compressed.data[key][:-10]
+        del compressed.calls[:]
+        assert load(MemcachedBytecodeCache(compressed)) == expected
+        assert compressed.calls == ['get', 'set']
+
+        directory = tempfile.mkdtemp()
+        try:
+            bcc = FileSystemBytecodeCache(directory, compression='zlib')
+            assert load(bcc) == expected
+            assert load(bcc) == expected
+            assert os.path.getsize(os.path.join(directory,
+                                                os.listdir(directory)[0])) \
+                == size
+        finally:
+            shutil.rmtree(directory)
+
+    def test_filesystem_lock_release(self):
+        from jinja2.bccache import FileSystemBytecodeCache, fcntl
+        if fcntl is None:
+            return
+        directory = tempfile.mkdtemp()
+        env = Environment()
+        bcc = FileSystemBytecodeCache(directory, lock=True)
+        def is_locked(bucket):
+            f = open(bcc._get_cache_filename(bucket) + '.lock', 'a')
+            try:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    return True
+                return False
+            finally:
+                f.close()
+        old_umask = os.umask(077)
+        try:
+            bucket = bcc.get_bucket(env, 'foo', None, u'foo')
+            assert is_locked(bucket)
+            bucket.code = env.compile(u'foo')
+            bcc.dump_bytecode(bucket)
+            assert not is_locked(bucket)
+            mode = os.stat(bcc._get_cache_filename(bucket)).st_mode
+            assert mode & 0777 == 0600
+            bucket = bcc.get_bucket(env, 'bar', None, u'bar')
+            filename = bcc._get_cache_filename(bucket)
+            assert is_locked(bucket)
+            del bucket
+            f = open(filename + '.lock', 'a')
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            finally:
+                f.close()
+        finally:
+            os.umask(old_umask)
+            shutil.rmtree(directory)
+
+    def test_filesystem_concurrent_writes(self):
+        from jinja2.bccache import fcntl
+        try:
+            from multiprocessing import Pool
+        except ImportError:
+            return
+        names = sorted(stress_templates)
+        directory = tempfile.mkdtemp()
+        try:
+            pool = Pool(4)
+            try:
+                compiled = pool.map(_bytecode_cache_worker, [
+                    (directory, names[x:] + names[:x])
+                    for x in range(0, len(names), 2)])
+            finally:
+                pool.terminate()
+            # with locking every template is compiled by one process only
+            if fcntl is not None:
+                assert sum(compiled) == len(names)
+            files = os.listdir(directory)
+            assert len([x for x in files if x.endswith('.cache')]) == \
+                len(names)
+            assert not [x for x in files if x.endswith('.tmp')]
+            if os.name == 'posix':
+                umask = os.umask(0)
+                os.umask(umask)
+                for name in files:
+                    if name.endswith('.cache'):
+                        mode = os.stat(os.path.join(directory, name)).st_mode
+                        assert mode & 0777 == 0666 & ~umask
+        finally:
+            shutil.rmtree(directory)
+
+
+class ArchiveLoaderTestCase(JinjaTestCase):
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_zip(self, members, precompiled=None, prefix=''):
+        from zipfile import ZipFile
+        filename = os.path.join(self.tmpdir, 'templates.zip')
+        zip_file = ZipFile(filename, 'w')
+        for name, source in members.iteritems():
+            zip_file.writestr(prefix + name, source)
+        if precompiled is not None:
+            compiled = os.path.join(self.tmpdir, 'compiled.zip')
+            env = Environment(loader=loaders.DictLoader(precompiled))
+            env.compile_templates(compiled, py_compile=True)
+            compiled_file = ZipFile(compiled)
+            for name in compiled_file.namelist():
+                zip_file.writestr(prefix + name, compiled_file.read(name))
+            compiled_file.close()
+        zip_file.close()
+        return filename
+
+    def test_zip(self):
+        filename = self.make_zip({'index.html': u'{% include "a/b.html" %}',
+                                  'a/b.html': u'B\xe4'.encode('utf-8')},
+                                 {'compiled.html': '{{ 1 + 1 }}'},
+                                 prefix='templates/')
+        loader = loaders.ArchiveLoader(filename, prefix='templates')
+        env = Environment(loader=loader)
+        assert env.get_template('index.html').render() == u'B\xe4'
+        assert env.get_template('./a/b.html').filename == \
+            os.path.join(filename, 'templates', 'a', 'b.html')
+        assert env.get_template('compiled.html').render() == '2'
+        assert env.list_templates() == ['a/b.html', 'index.html']
+        self.assert_raises(TemplateNotFound, env.get_template, 'missing')
+        self.assert_raises(TemplateNotFound, env.get_template,
+                           'templates/index.html')
+
+    def test_tar(self):
+        import tarfile
+        from StringIO import StringIO
+        filename = os.path.join(self.tmpdir, 'templates.tar.gz')
+        tar = tarfile.open(filename, 'w:gz')
+        info = tarfile.TarInfo('foo/test.html')
+        info.size = 3
+        tar.addfile(info, StringIO('FOO'))
+        tar.close()
+        env = Environment(loader=loaders.ArchiveLoader(filename))
+        assert env.get_template('foo/test.html').render() == 'FOO'
+        assert env.list_templates() == ['foo/test.html']
+
+    def test_reload(self):
+        class CountingLoader(loaders.ArchiveLoader):
+            opened = 0
+            def _open(self):
+                self.opened += 1
+                loaders.ArchiveLoader._open(self)
+        names = ['test%d.html' % x for x in range(5)]
+        filename = self.make_zip(dict.fromkeys(names, 'one'))
+        loader = CountingLoader(filename)
+        env = Environment(loader=loader)
+        tmpl = env.get_template('test0.html')
+        assert tmpl is env.get_template('test0.html')
+        for name in names[1:]:
+            env.get_template(name)
+        self.make_zip(dict.fromkeys(names, 'two'))
+        mtime = os.path.getmtime(filename) + 10
+        os.utime(filename, (mtime, mtime))
+        for name in names:
+            assert env.get_template(name).render() == 'two'
+        # the archive is opened again only once for all the templates
+        assert loader.opened == 2
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(LoaderTestCase))
     suite.addTest(unittest.makeSuite(ModuleLoaderTestCase))
+    suite.addTest(unittest.makeSuite(BytecodeCacheTestCase))
+    suite.addTest(unittest.makeSuite(ArchiveLoaderTestCase))
     return suite
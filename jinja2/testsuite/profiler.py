@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+    jinja2.testsuite.profiler
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the template profiler.
+
+    :copyright: (c) 2010 by the Jinja Team.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import pstats
+import tempfile
+import unittest
+
+from jinja2.testsuite import JinjaTestCase
+
+from jinja2 import Environment, DictLoader
+from jinja2.profiler import Profiler
+
+
+env = Environment(loader=DictLoader({
+    'layout':   '<{% block body %}{% endblock %}>',
+    'index':    '{% extends "layout" %}\n'
+                '{% macro item(x) %}[{{ x }}]{% endmacro %}\n'
+                '{% block body %}\n'
+                '{% for x in seq %}\n'
+                '{{ item(x) }}\n'
+                '{% endfor %}\n'
+                '{% endblock %}'
+}))
+
+
+class ProfilerTestCase(JinjaTestCase):
+
+    def profile(self):
+        profiler = Profiler()
+        rv = profiler.runcall(env.get_template('index').render, seq=range(3))
+        assert rv.split() == ['<', '[0]', '[1]', '[2]', '>']
+        return profiler
+
+    def test_functions(self):
+        functions = dict(((template, kind, name, lineno), stats[0])
+                         for (template, kind, name, filename, lineno), stats
+                         in self.profile().functions.iteritems())
+        assert functions == {
+            ('index', 'template', 'index', 1): 1,
+            ('layout', 'template', 'layout', 1): 1,
+            ('index', 'block', 'body', 3): 1,
+            ('index', 'macro', 'item', 2): 3
+        }
+
+    def test_lines(self):
+        profiler = self.profile()
+        assert profiler.lines['index', 5][0] >= 3
+        for template, lineno in profiler.lines:
+            assert template in ('index', 'layout')
+
+    def test_report(self):
+        report = self.profile().report(sort='calls')
+        lines = report.splitlines()
+        assert lines[1].startswith('macro item (index:2)')
+        assert 'template layout' in report
+        assert 'index:5' in report
+
+    def test_pstats(self):
+        profiler = self.profile()
+        stats = pstats.Stats(profiler)
+        assert stats.total_calls == 6
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            profiler.dump_stats(filename)
+            stats = pstats.Stats(filename)
+        finally:
+            os.remove(filename)
+        assert stats.stats[('<template>', 2, 'macro item')][:2] == (3, 3)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ProfilerTestCase))
+    return suite
@@ -179,15 +179,19 @@ def consume(iterable):
 
 
 def clear_caches():
-    """Jinja2 keeps internal caches for environments and lexers.  These are
-    used so that Jinja2 doesn't have to recreate environments and lexers all
-    the time.  Normally you don't have to care about that but if you are
-    messuring memory consumption you may want to clean the caches.
+    """Jinja2 keeps internal caches for environments, lexers and the code of
+    compiled templates.  These are used so that Jinja2 doesn't have to
+    recreate environments and lexers or compile templates all the time.
+    Normally you don't have to care about that but if you are messuring
+    memory consumption you may want to clean the caches.
     """
-    from jinja2.environment import _spontaneous_environments
-    from jinja2.lexer import _lexer_cache
+    from jinja2.environment import _spontaneous_environments, _code_caches
+    from jinja2.lexer import _lexer_cache, _rules_cache
     _spontaneous_environments.clear()
+    for cache in _code_caches.itervalues():
+        cache.clear()
     _lexer_cache.clear()
+    _rules_cache.clear()
 
 
 def import_string(import_name, silent=False):
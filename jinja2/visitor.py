@@ -9,6 +9,80 @@
     :license: BSD.
 """
 from jinja2.nodes import Node
+from jinja2.utils import FunctionType
+
+
+def _is_inherited(cls, name):
+    """Checks if `cls` uses the implementation of `NodeVisitor` for the
+    method `name`.
+    """
+    # the dispatcher of NodeVisitor is created before the name is bound
+    node_visitor = globals().get('NodeVisitor', cls)
+    for base in cls.__mro__:
+        if name in base.__dict__:
+            return base is node_visitor
+    return True
+
+
+class _Dispatcher(object):
+    """Caches the visitor functions of a visitor class by node class.  The
+    dispatcher is stored on the class and doesn't reference it.
+    """
+
+    def __init__(self, cls):
+        self.table = {}
+        # a visitor that overrides `get_visitor` might dispatch on more
+        # than the node class, such visitors are not cached.
+        self.cacheable = _is_inherited(cls, 'get_visitor')
+        # only the default visit and generic visit can be flattened into
+        # a loop as overrides have to be called for every node.
+        self.iterative = self.cacheable and \
+            _is_inherited(cls, 'visit') and \
+            _is_inherited(cls, 'generic_visit')
+
+    def lookup(self, cls, node_cls):
+        name = 'visit_' + node_cls.__name__
+        for base in cls.__mro__:
+            if name in base.__dict__:
+                func = base.__dict__[name]
+                break
+        else:
+            func = None
+        # staticmethods, properties and other descriptors are resolved
+        # on every call
+        if func is not None and not isinstance(func, FunctionType):
+            func = lambda self, *args, **kwargs: \
+                getattr(self, name)(*args, **kwargs)
+        rv = self.table[node_cls] = (name, func)
+        return rv
+
+
+class VisitorType(type):
+    """Metaclass for node visitors.  Gives every visitor class a fresh
+    dispatcher and replaces the dispatchers when visitor methods are
+    assigned to or deleted from the class later.
+    """
+
+    def __init__(cls, name, bases, d):
+        type.__init__(cls, name, bases, d)
+        cls._dispatcher = _Dispatcher(cls)
+
+    def __setattr__(cls, name, value):
+        type.__setattr__(cls, name, value)
+        cls._reset_dispatchers(name)
+
+    def __delattr__(cls, name):
+        type.__delattr__(cls, name)
+        cls._reset_dispatchers(name)
+
+    def _reset_dispatchers(cls, name):
+        if name.startswith('visit') or \
+           name in ('generic_visit', 'get_visitor'):
+            todo = [cls]
+            while todo:
+                cls = todo.pop()
+                type.__setattr__(cls, '_dispatcher', _Dispatcher(cls))
+                todo.extend(cls.__subclasses__())
 
 
 class NodeVisitor(object):
@@ -21,7 +95,12 @@ class NodeVisitor(object):
     be `visit_TryFinally`.  This behavior can be changed by overriding
     the `get_visitor` function.  If no visitor function exists for a node
     (return value `None`) the `generic_visit` visitor is used instead.
+
+    The visitor functions are looked up on the class of the visitor once
+    per node class and cached unless `get_visitor` is overridden.  Visitor
+    functions set on the instance take precedence like with `getattr`.
     """
+    __metaclass__ = VisitorType
 
     def get_visitor(self, node):
         """Return the visitor function for this node or `None` if no visitor
@@ -33,6 +112,17 @@ class NodeVisitor(object):
 
     def visit(self, node, *args, **kwargs):
         """Visit a node."""
+        dispatcher = self._dispatcher
+        if dispatcher.cacheable:
+            entry = dispatcher.table.get(node.__class__)
+            if entry is None:
+                entry = dispatcher.lookup(self.__class__, node.__class__)
+            name, f = entry
+            if name in self.__dict__:
+                return self.__dict__[name](node, *args, **kwargs)
+            if f is not None:
+                return f(self, node, *args, **kwargs)
+            return self.generic_visit(node, *args, **kwargs)
         f = self.get_visitor(node)
         if f is not None:
             return f(node, *args, **kwargs)
@@ -40,8 +130,34 @@ class NodeVisitor(object):
 
     def generic_visit(self, node, *args, **kwargs):
         """Called if no explicit visitor function exists for a node."""
-        for node in node.iter_child_nodes():
-            self.visit(node, *args, **kwargs)
+        dispatcher = self._dispatcher
+        if not dispatcher.iterative or 'visit' in self.__dict__:
+            for node in node.iter_child_nodes():
+                self.visit(node, *args, **kwargs)
+            return
+
+        # walk the children of nodes without visitor function in a loop
+        # instead of recursing into generic_visit for every one of them.
+        # the order in which the visitor functions are called is the same.
+        table = dispatcher.table
+        instance_dict = self.__dict__
+        cls = self.__class__
+        todo = node._get_child_nodes()
+        todo.reverse()
+        while todo:
+            node = todo.pop()
+            entry = table.get(node.__class__)
+            if entry is None:
+                entry = dispatcher.lookup(cls, node.__class__)
+            name, f = entry
+            if name in instance_dict:
+                instance_dict[name](node, *args, **kwargs)
+            elif f is not None:
+                f(self, node, *args, **kwargs)
+            else:
+                children = node._get_child_nodes()
+                children.reverse()
+                todo.extend(children)
 
 
 class NodeTransformer(NodeVisitor):